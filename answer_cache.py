@@ -0,0 +1,131 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from answering import PROMPT_VERSION
+
+
+def normalize_question(question):
+    """表記ゆれを吸収した質問文 (全角半角・空白・末尾の？を統一)"""
+    q = unicodedata.normalize("NFKC", question).strip().lower()
+    q = re.sub(r"\s+", " ", q)
+    return q.rstrip("?？。 ")
+
+
+def answer_key(question, manual_version, model, top_k):
+    """回答キャッシュのキー (マニュアル・プロンプトの版、モデル、検索件数のどれかが変われば別物)"""
+    raw = f"{manual_version}\n{PROMPT_VERSION}\n{model}\n{top_k}\n{normalize_question(question)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class AnswerCache:
+    """回答キャッシュ (LRU + TTL、任意でディスク層、同一質問の同時実行は1回にまとめる)"""
+    def __init__(self, max_entries=256, ttl=86400, disk_dir=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        if disk_dir: os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+        value = self._read_disk(key, now)
+        if value is not None:
+            self._remember(key, value, now)
+        return value
+
+    def put(self, key, value):
+        now = time.time()
+        self._remember(key, value, now)
+        self._write_disk(key, value, now)
+
+    def discard(self, keys):
+        """指定キーをメモリ・ディスクから消す (古い版の先回り生成分の片付け用)"""
+        with self._lock:
+            for key in keys: self._entries.pop(key, None)
+        if not self.disk_dir: return
+        for key in keys:
+            try: os.remove(os.path.join(self.disk_dir, f"{key}.json"))
+            except OSError: pass
+
+    def get_or_compute(self, key, compute):
+        """(value, cached) を返す。同じキーの計算中は完了を待って結果を共有"""
+        value = self.get(key)
+        if value is not None: return value, True
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader: flight = self._inflight[key] = _Flight()
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None: raise flight.error
+            return flight.value, True
+        try:
+            # 待っている間に別スレッドが書き込んだ場合はそれを使う
+            value = self.get(key)
+            cached = value is not None
+            if not cached:
+                value = compute()
+                self.put(key, value)
+            flight.value = value
+            return value, cached
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def _remember(self, key, value, now):
+        with self._lock:
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _read_disk(self, key, now):
+        if not self.disk_dir: return None
+        path = os.path.join(self.disk_dir, f"{key}.json")
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if now - entry.get("stored_at", 0) > self.ttl:
+            try: os.remove(path)
+            except OSError: pass
+            return None
+        return entry.get("value")
+
+    def _write_disk(self, key, value, now):
+        if not self.disk_dir: return
+        path = os.path.join(self.disk_dir, f"{key}.json")
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"stored_at": now, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError:
+            pass
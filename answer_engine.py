@@ -0,0 +1,78 @@
+import time
+import threading
+from collections import OrderedDict
+from answering import HybridResponseParser, build_prefix, build_suffix, cached_tokens, iter_chunk_text, prefix_key, usage_tokens
+from retrieval import ManualIndex, split_pages
+from context_cache import prefix_gone
+from metrics import METRICS
+
+
+class AnswerEngine:
+    """質問 → プロンプト → モデル → 回答の解析 (画面と一括実行で共用)"""
+    def __init__(self, model_factory, top_k=8, token_budget=12000, context_cache=None, index_for=None):
+        self.model_factory = model_factory
+        # top_k=0 ならマニュアル全文を固定の接頭辞に入れる
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.context_cache = context_cache
+        self.index_for = index_for or self._index
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index(self, corpus):
+        """版ごとの検索インデックス (直近2版だけ保持)"""
+        with self._lock:
+            index = self._indexes.get(corpus.version)
+            if index is not None: return index
+        index = ManualIndex(split_pages(corpus.iter_texts()))
+        with self._lock:
+            self._indexes[corpus.version] = index
+            while len(self._indexes) > 2: self._indexes.popitem(last=False)
+        return index
+
+    def open_model(self, corpus, question, use_cache=True):
+        """(モデル, 送る本文, 接頭辞キー)。接頭辞が登録済みなら質問ごとの後半だけを送る"""
+        full_manual = self.top_k <= 0
+        with METRICS.timer("answer.prompt_build"):
+            prefix = build_prefix(corpus.text if full_manual else None)
+            context = None if full_manual else self.index_for(corpus).select_context(question, self.top_k, self.token_budget)
+            suffix = build_suffix(question, context)
+        if use_cache and self.context_cache is not None:
+            key = prefix_key(corpus.version, full_manual)
+            model = self.context_cache.model(key, prefix)
+            if model is not None: return model, suffix, key
+        return self.model_factory(), prefix + suffix, None
+
+    def start(self, corpus, question, stream):
+        """モデル呼び出しを開始する。登録済みの接頭辞が消えていたら全文送信でやり直す"""
+        model, prompt, key = self.open_model(corpus, question)
+        try:
+            return model.generate_content(prompt, stream=stream), len(prompt)
+        except Exception as e:
+            # 接頭辞がサーバー側で消えた場合だけやり直す
+            if key is None or not prefix_gone(e): raise
+            self.context_cache.invalidate(key)
+            model, prompt, _ = self.open_model(corpus, question, use_cache=False)
+            return model.generate_content(prompt, stream=stream), len(prompt)
+
+    def answer(self, corpus, question, stream=True, on_text=None):
+        """(回答 {"text", "chart", "suggestions"}, 所要時間・サイズ)。on_text には確定した文章を都度渡す"""
+        timing = {}
+        started = time.perf_counter()
+        parser = HybridResponseParser()
+        response, timing["prompt_chars"] = self.start(corpus, question, stream)
+        if stream:
+            for piece in iter_chunk_text(response):
+                if "ttft_s" not in timing:
+                    timing["ttft_s"] = time.perf_counter() - started
+                    METRICS.observe("answer.first_token", timing["ttft_s"])
+                if parser.feed(piece) and on_text: on_text(parser.prose)
+        else:
+            parser.feed(response.text)
+        timing["generate_s"] = time.perf_counter() - started
+        METRICS.observe("answer.generate", timing["generate_s"])
+        timing["response_chars"] = parser.chars
+        timing["prompt_tokens"], timing["output_tokens"] = usage_tokens(response)
+        timing["cached_tokens"] = cached_tokens(response)
+        with METRICS.timer("answer.parse"):
+            return parser.close(), timing
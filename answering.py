@@ -0,0 +1,246 @@
+import re
+import json
+
+FENCE_LANG_RE = re.compile(r"\w*")
+DOT_HEAD_RE = re.compile(r'digraph\s{0,200}(?:"[^"\n]{0,200}"|\w{1,200})?\s{0,200}\{')
+DOT_TOKEN_RE = re.compile(r'[{}"\\]')
+# 「digraph」から { までに許す最大文字数 (ストリーミング時の保留判定)
+MAX_DOT_HEAD = 200
+HOLD_BACK = len("digraph") - 1
+
+PROSE, FENCE, DOT = "prose", "fence", "dot"
+
+
+# 人物設定と出力ルール (質問によらず固定。変えたら PROMPT_VERSION を上げる)
+PROMPT_VERSION = "1"
+PERSONA_RULES = """
+【最重要設定】
+あなたはRSJP（立命館大学 留学サポートデスク）の**頼れる優しい先輩社員**です。
+単なる検索システムではなく、不安な後輩（ユーザー）を支えるパートナーとして振る舞ってください。
+
+【回答のルール】
+1. **説明のボリューム**:
+   - 決して簡潔に済ませず、**詳しく、丁寧に**説明してください。
+   - 「なぜそうするのか」という背景や理由も付け加えて、納得感を高めてください。
+
+2. **必須の構成**:
+   - **導入と共感**: 「焦らず一緒に確認しましょう」など安心させる言葉から始める。
+   - **具体的な手順**: 番号付きリストで詳細に。
+   - **先輩からのアドバイス**: 間違いやすいポイントやコツを親身に教える。
+   - **締め**: 「応援しています」などの温かい言葉。
+
+3. **フローチャート（最重要）**:
+   - **必ず縦長 (`rankdir=TB`) で作成してください。**
+   - 省略せずに、**ステップを細かく分解してノード数を増やしてください。**
+   - DOT言語 (digraph) を使用し、Mermaidは禁止です。
+
+【技術的な出力ルール】
+1. まず、上記の構成で**通常の文章（マークダウン）**を出力してください。
+2. その後に、以下のJSONブロックを1つだけ出力してください。
+
+```json
+{
+    "chart_code": "digraph G { rankdir=TB; ... }", 
+    "related_questions": ["申請期限はいつ？", "必要書類は？", "代理申請は可能？"]
+}
+```
+
+**※重要1: `related_questions` には "Q1" 等ではなく、文脈に沿った具体的な次の質問文（例: "期限は？"）を入れてください。**
+**※重要2: `digraph ...` というコードは、絶対に「文章」の中には書かないでください。JSONの中だけに書いてください。**
+"""
+
+
+def build_prefix(manual_text=None):
+    """全質問で共通の前半 (ルール、全文を送る場合はマニュアルも)。版が同じなら常に同じ文字列"""
+    prefix = PERSONA_RULES
+    if manual_text is not None: prefix += f"\n【マニュアル】\n{manual_text}\n"
+    return prefix
+
+
+def build_suffix(question, manual_context=None):
+    """質問ごとの後半 (検索で選んだマニュアル区画と質問)"""
+    suffix = f"\n【マニュアル】\n{manual_context}\n" if manual_context is not None else ""
+    return suffix + f"\n【質問】{question}\n"
+
+
+def prefix_key(manual_version, full_manual):
+    """接頭辞の版 (ルールの版 + 全文を含むならマニュアルの版)"""
+    return f"rsjp-p{PROMPT_VERSION}-{manual_version if full_manual else 'rules'}"
+
+
+def iter_chunk_text(response):
+    """ストリーミング応答から文字列だけを取り出す (本文の無いチャンクは飛ばす)"""
+    for chunk in response:
+        try: text = chunk.text
+        except (ValueError, AttributeError): continue
+        if text: yield text
+
+
+def usage_tokens(response):
+    """応答の (入力トークン数, 出力トークン数)。取れなければ None"""
+    try:
+        usage = response.usage_metadata
+        return usage.prompt_token_count, usage.candidates_token_count
+    except Exception:
+        return None, None
+
+
+def cached_tokens(response):
+    """入力のうちコンテキストキャッシュから読まれたトークン数"""
+    try:
+        return response.usage_metadata.cached_content_token_count or 0
+    except Exception:
+        return 0
+
+
+class HybridResponseParser:
+    """回答を1パスで「文章」「```json ブロック」「生のDOT/Mermaid」に振り分ける (チャンク単位で投入可)"""
+    def __init__(self):
+        self.buf = ""
+        self.pos = 0
+        self.chars = 0
+        self.state = PROSE
+        self.parts = []
+        self.chart = None
+        self.fallback_chart = None
+        self.suggestions = []
+        self.json_done = False
+        # FENCE / DOT の途中経過 (続きのチャンクが来たらここから再開)
+        self.start = 0
+        self.lang = ""
+        self.body = 0
+        self.scan = 0
+        self.depth = 0
+        self.in_quote = False
+
+    @property
+    def prose(self):
+        """ここまでに確定した表示用の文章"""
+        return "".join(self.parts)
+
+    def feed(self, piece):
+        """チャンクを追加し、新たに確定した文章を返す"""
+        before = len(self.parts)
+        self.chars += len(piece)
+        self.buf += piece
+        self._scan(final=False)
+        self._compact()
+        return "".join(self.parts[before:])
+
+    def close(self):
+        self._scan(final=True)
+        return {"text": self.prose.strip(), "chart": self.chart or self.fallback_chart, "suggestions": self.suggestions}
+
+    def _compact(self):
+        """処理済みの先頭を捨て、バッファには未確定の末尾だけを残す"""
+        if self.pos == 0: return
+        self.buf = self.buf[self.pos:]
+        self.start -= self.pos
+        self.body -= self.pos
+        self.scan -= self.pos
+        self.pos = 0
+
+    def _emit(self, end):
+        if end > self.pos: self.parts.append(self.buf[self.pos:end])
+        self.pos = end
+
+    def _scan(self, final):
+        buf = self.buf
+        # 次の ``` / digraph の位置 (-1 ならこのバッファ内にはもう無い)
+        fence_at = dot_at = None
+        while True:
+            if self.state == PROSE:
+                if fence_at is None or 0 <= fence_at < self.pos: fence_at = buf.find("```", self.pos)
+                if dot_at is None or 0 <= dot_at < self.pos: dot_at = buf.find("digraph", self.pos)
+                if fence_at < 0 and dot_at < 0:
+                    # 末尾が目印の書きかけかもしれないので少し保留
+                    self._emit(len(buf) if final else max(self.pos, len(buf) - HOLD_BACK))
+                    return
+                at = fence_at if dot_at < 0 or 0 <= fence_at < dot_at else dot_at
+                self._emit(at)
+                if at == fence_at:
+                    lang_end = FENCE_LANG_RE.match(buf, at + 3).end()
+                    if lang_end == len(buf) and not final: return
+                    self.state, self.start, self.lang = FENCE, at, buf[at + 3:lang_end].lower()
+                    self.body = self.scan = lang_end
+                else:
+                    head = DOT_HEAD_RE.match(buf, at)
+                    if head is None:
+                        if not final and len(buf) - at < MAX_DOT_HEAD and "{" not in buf[at:]:
+                            return
+                        self._emit(at + len("digraph"))
+                        continue
+                    self.state, self.start = DOT, at
+                    self.scan, self.depth, self.in_quote = head.end(), 1, False
+            elif self.state == FENCE:
+                close = buf.find("```", self.scan)
+                if close < 0:
+                    if not final:
+                        self.scan = max(self.body, len(buf) - 2)
+                        return
+                    # 閉じられていないフェンスはそのまま文章扱い
+                    self.state = PROSE
+                    self._emit(len(buf))
+                    return
+                if self._drop_fence(buf[self.body:close]): self.pos = close + 3
+                else: self._emit(close + 3)
+                self.state = PROSE
+            else:
+                end = self._scan_dot(buf)
+                if end is None:
+                    if not final: return
+                    # 閉じ括弧が来ないまま終わったDOTは描画できないので文章からも図からも外す
+                    end = len(buf)
+                elif self.fallback_chart is None:
+                    self.fallback_chart = buf[self.start:end]
+                self.pos = end
+                self.state = PROSE
+
+    def _drop_fence(self, content):
+        """JSON・DOT・Mermaid のフェンスなら中身を取り込んで True (文章から除く)"""
+        stripped = content.lstrip()
+        if self.lang == "json" and not self.json_done:
+            self.json_done = True
+            try:
+                data = json.loads(content.strip())
+                self.chart = data.get("chart_code")
+                self.suggestions = data.get("related_questions", [])
+            except:
+                # 壊れたJSON (末尾のカンマ・ラベル内の未エスケープの " 等) でも図だけは拾う
+                if self.fallback_chart is None: self.fallback_chart = parse_hybrid_response(content)["chart"]
+            return True
+        if self.lang in ("", "dot", "graphviz") and stripped.startswith("digraph"):
+            if self.fallback_chart is None:
+                self.fallback_chart = parse_hybrid_response(stripped)["chart"] or stripped.rstrip()
+            return True
+        return self.lang in ("", "mermaid") and stripped.startswith("graph")
+
+    def _scan_dot(self, buf):
+        """{ } の対応を数えてDOTの終端位置を返す (文字列リテラル内は無視)。未完なら None"""
+        pos = self.scan
+        while True:
+            m = DOT_TOKEN_RE.search(buf, pos)
+            if m is None:
+                self.scan = len(buf)
+                return None
+            ch = m.group()
+            if ch == "\\":
+                if m.end() >= len(buf):
+                    self.scan = m.start()
+                    return None
+                pos = m.end() + 1
+                continue
+            pos = m.end()
+            if ch == '"':
+                self.in_quote = not self.in_quote
+            elif not self.in_quote:
+                self.depth += 1 if ch == "{" else -1
+                if self.depth == 0:
+                    return pos
+
+
+def parse_hybrid_response(text):
+    """テキストとJSONを分離し、テキスト側に残った生コードを強力に削除する"""
+    parser = HybridResponseParser()
+    parser.feed(text)
+    return parser.close()
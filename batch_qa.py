@@ -0,0 +1,174 @@
+"""一括QA実行 (画面を使わずに質問をまとめて流す)
+
+質問のJSON Lines (1行に {"id": ..., "question": ...} か質問文の文字列) を読み、
+同期済みまたは保存済みのマニュアルに対して並列数・レート制限つきで回答させ、
+回答と質問ごとの所要時間をJSON Linesで書き出す。
+
+    python batch_qa.py questions.jsonl -o results.jsonl --manual manual.txt --concurrency 8 --rate 2
+    python batch_qa.py questions.jsonl -o results.jsonl --sync --save-snapshot .manual_snapshot
+    python batch_qa.py questions.jsonl -o results.jsonl --snapshot .manual_snapshot
+    python batch_qa.py questions.jsonl -o results.jsonl --fake-notion 300 --fake-model --fake-ttft 0.3
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from answer_engine import AnswerEngine
+from context_cache import ContextCache, GeminiContextBackend, LocalContextBackend
+from manual_corpus import ManualCorpus
+from manual_snapshot import load_snapshot, save_snapshot
+from metrics import METRICS
+from notion_loader import FullNotionLoader, SyncState, TokenBucket
+
+
+def read_questions(path):
+    questions = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line: continue
+            item = json.loads(line)
+            if isinstance(item, str): item = {"question": item}
+            item.setdefault("id", n)
+            questions.append(item)
+    return questions
+
+
+def load_corpus(args):
+    """--manual / --snapshot / --sync / --fake-notion のいずれかでマニュアルを用意する"""
+    if args.snapshot:
+        corpus = load_snapshot(args.snapshot)
+        if corpus is None: sys.exit(f"{args.snapshot} にスナップショットがありません")
+        return corpus
+    if args.manual:
+        with open(args.manual, encoding="utf-8") as f:
+            text = f.read()
+        return ManualCorpus(text, text.count("【ページ: "))
+    if args.fake_notion:
+        from fake_notion import FakeNotionClient
+        client = FakeNotionClient(pages=args.fake_notion, seed=args.seed)
+        loader = FullNotionLoader(None, max_workers=args.sync_workers, limiter=TokenBucket(1e9, 1000000), client=client)
+        text, count = loader.load_recursive(client.root_id, lambda msg: None)
+        return ManualCorpus(text, count, pages=loader.page_spans)
+    key, page_id = os.getenv("NOTION_API_KEY"), os.getenv("NOTION_PAGE_ID")
+    if not key or not page_id:
+        sys.exit("NOTION_API_KEY / NOTION_PAGE_ID が設定されていません (--manual でファイルも指定できます)")
+    loader = FullNotionLoader(key, max_workers=args.sync_workers)
+    state = SyncState(os.getenv("NOTION_SYNC_STATE", ".notion_sync_state.json"))
+    text, count = loader.load_incremental(page_id, lambda msg: print(msg, file=sys.stderr), state, strict=True)
+    state.save()
+    return ManualCorpus(text, count, pages=loader.page_spans)
+
+
+def build_engine(args):
+    if args.fake_model:
+        from fake_gemini import FakeGeminiModel
+        fake = FakeGeminiModel(ttft=args.fake_ttft, chunk_delay=args.fake_chunk_delay, error_rate=args.fake_error_rate,
+                               seed=args.seed)
+        model_factory = lambda: fake
+    else:
+        import google.generativeai as genai
+        if not os.getenv("GOOGLE_API_KEY"): sys.exit("GOOGLE_API_KEY が設定されていません (--fake-model でオフライン実行)")
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        model_factory = lambda: genai.GenerativeModel(args.model)
+    contexts = None
+    if args.context_cache == "local" or (args.context_cache == "gemini" and args.fake_model):
+        contexts = ContextCache(LocalContextBackend(model_factory, args.context_cache_min_chars))
+    elif args.context_cache == "gemini":
+        contexts = ContextCache(GeminiContextBackend(args.model, args.context_cache_min_chars))
+    return AnswerEngine(model_factory, args.top_k, args.token_budget, contexts)
+
+
+def run_one(engine, corpus, item, limiter, stream, submitted):
+    dequeued = time.perf_counter()
+    if limiter: limiter.acquire()
+    started = time.perf_counter()
+    # queue_s: 空きワーカー待ち、wait_s: レート制限待ち
+    record = {"id": item["id"], "question": item["question"], "manual_version": corpus.version,
+              "queue_s": round(dequeued - submitted, 4), "wait_s": round(started - dequeued, 4)}
+    try:
+        data, timing = engine.answer(corpus, item["question"], stream=stream)
+        record.update(ok=True, **data)
+    except Exception as e:
+        timing = {}
+        record.update(ok=False, error=f"{type(e).__name__}: {e}")
+    timing["total_s"] = time.perf_counter() - started
+    record["timing"] = {k: round(v, 4) if isinstance(v, float) else v for k, v in timing.items()}
+    return record
+
+
+def _pct(values, q):
+    if not values: return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(round(q * (len(values) - 1))))], 3)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="一括QA実行")
+    parser.add_argument("questions", help="質問のJSON Lines")
+    parser.add_argument("-o", "--output", required=True, help="結果を書き出すJSON Lines")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--manual", help="保存済みマニュアル (本文テキスト)")
+    source.add_argument("--snapshot", metavar="DIR", help="保存済みスナップショット (manual_snapshot 形式)")
+    source.add_argument("--sync", action="store_true", help="Notionから差分同期する (既定)")
+    source.add_argument("--fake-notion", type=int, metavar="PAGES", help="合成マニュアルで実行 (オフライン)")
+    parser.add_argument("--save-manual", help="使ったマニュアル本文の保存先")
+    parser.add_argument("--save-snapshot", metavar="DIR", help="使ったマニュアルをスナップショットとして保存")
+    parser.add_argument("--sync-workers", type=int, default=int(os.getenv("NOTION_SYNC_WORKERS", "4")))
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に投げる質問数")
+    parser.add_argument("--rate", type=float, default=0, help="質問の開始レート req/s (0 で無制限)")
+    parser.add_argument("--no-stream", action="store_true", help="ストリーミングせず一括で受け取る")
+    parser.add_argument("--model", default=os.getenv("GEMINI_MODEL", "gemini-2.0-flash"))
+    parser.add_argument("--top-k", type=int, default=int(os.getenv("RETRIEVAL_TOP_K", "8")))
+    parser.add_argument("--token-budget", type=int, default=int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "12000")))
+    parser.add_argument("--context-cache", choices=["gemini", "local", "off"], default=os.getenv("CONTEXT_CACHE", "gemini"))
+    parser.add_argument("--context-cache-min-chars", type=int, default=int(os.getenv("CONTEXT_CACHE_MIN_CHARS", "8000")))
+    parser.add_argument("--fake-model", action="store_true", help="Geminiの代わりに FakeGeminiModel を使う")
+    parser.add_argument("--fake-ttft", type=float, default=0.0, help="偽モデルの最初の応答までの秒数")
+    parser.add_argument("--fake-chunk-delay", type=float, default=0.0, help="偽モデルのチャンク間隔(秒)")
+    parser.add_argument("--fake-error-rate", type=float, default=0.0, help="偽モデルが429を返す確率")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions)
+    corpus = load_corpus(args)
+    if args.save_manual:
+        with open(args.save_manual, "w", encoding="utf-8") as f:
+            f.write(corpus.text)
+    if args.save_snapshot: save_snapshot(corpus, args.save_snapshot)
+    engine = build_engine(args)
+    limiter = TokenBucket(args.rate, max(1, int(args.rate))) if args.rate > 0 else None
+    print(f"manual {corpus.version}: {corpus.page_count} pages / {len(questions)} questions",
+          file=sys.stderr)
+
+    results = []
+    started = time.perf_counter()
+    with open(args.output, "w", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        futures = [pool.submit(run_one, engine, corpus, item, limiter, not args.no_stream, time.perf_counter())
+                   for item in questions]
+        for future in as_completed(futures):
+            record = future.result()
+            results.append(record)
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+    wall = time.perf_counter() - started
+
+    ok = [r for r in results if r["ok"]]
+    totals = [r["timing"]["total_s"] for r in ok]
+    ttfts = [r["timing"]["ttft_s"] for r in ok if "ttft_s" in r["timing"]]
+    print(f"done {len(ok)}/{len(results)} ok in {wall:.2f}s ({len(results) / wall if wall else 0:.2f} q/s)"
+          f"  total p50={_pct(totals, 0.5)} p95={_pct(totals, 0.95)}  ttft p50={_pct(ttfts, 0.5)} p95={_pct(ttfts, 0.95)}",
+          file=sys.stderr)
+    counters = METRICS.summary()["counters"]
+    if counters.get("context_cache.creates"):
+        print(f"context cache: {counters.get('context_cache.creates', 0):g} creates, "
+              f"{counters.get('context_cache.hits', 0):g} hits", file=sys.stderr)
+    return 0 if len(ok) == len(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""回答パーサーのベンチマーク
+
+旧来の正規表現カスケード版と HybridResponseParser (1パス) を、大きな回答と
+意地悪な入力 (閉じない ``` や { の無い digraph の連続など) で比較する。
+ストリーミング時と同じくチャンク単位で投入する場合の時間も計測する。
+計測の前に、既知の入力で解析結果を確認する (--check-only なら確認だけ行う)。
+
+    python benchmarks/bench_parser.py
+    python benchmarks/bench_parser.py --check-only
+    python benchmarks/bench_parser.py --sizes 100000 1000000 --chunk 40 --repeat 3
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from answering import HybridResponseParser, iter_chunk_text, parse_hybrid_response
+from fake_gemini import FakeGeminiModel
+
+
+def legacy_parse(text):
+    """置き換え前の実装 (比較用)"""
+    result = {"text": "", "chart": None, "suggestions": []}
+    match = re.search(r"```json(.*?)```", text, re.DOTALL)
+    if match:
+        try:
+            data = json.loads(match.group(1).strip())
+            result["chart"] = data.get("chart_code")
+            result["suggestions"] = data.get("related_questions", [])
+        except:
+            pass
+        text_part = text.replace(match.group(0), "").strip()
+    else:
+        text_part = text.strip()
+    text_part = re.sub(r"```(?:dot|graphviz)?\s*digraph.*?```", "", text_part, flags=re.DOTALL)
+    text_part = re.sub(r"```(?:mermaid)?\s*graph.*?```", "", text_part, flags=re.DOTALL)
+    text_part = re.sub(r"digraph\s+.*?}", "", text_part, flags=re.DOTALL | re.MULTILINE)
+    if not result["chart"]:
+        code_match = re.search(r"digraph.*?\}", text, re.DOTALL)
+        if code_match:
+            result["chart"] = code_match.group(0)
+    result["text"] = text_part.strip()
+    return result
+
+
+def typical(size):
+    """文章 + 末尾の JSON ブロック (通常の回答を size 文字まで水増し)"""
+    line = "■ 申請書類は窓口に提出してください。締切は**毎月10日**です。\n"
+    prose = line * max(1, size // len(line))
+    block = json.dumps({"chart_code": 'digraph { A -> B; B -> C; }', "related_questions": ["Q1", "Q2", "Q3"]},
+                       ensure_ascii=False)
+    return f"{prose}\n```json\n{block}\n```\n"
+
+
+def adversarial(size):
+    return {
+        "digraph-no-brace": "digraph " * (size // 8),
+        "unclosed-fences": "```\n本文 " * (size // 8),
+        "nested-braces": "digraph G {" + "{" * (size // 2) + "}" * (size // 2),
+        "stray-digraph-prose": ("手順は digraph の説明です。" * (size // 16)) + "}",
+    }
+
+
+# (名前, 入力, 期待する結果)。期待値が None なら旧実装と同じ結果になること
+CASES = [
+    ("json-block", '説明です。\n```json\n{"chart_code": "digraph { A -> B; }", "related_questions": ["Q1"]}\n```', None),
+    ("bare-dot", "手順:\ndigraph G { A -> B; }\n以上です。", None),
+    ("dot-fence", "手順:\n```dot\ndigraph { A -> B; }\n```\n以上です。", None),
+    ("mermaid-fence", "手順:\n```mermaid\ngraph TD; A-->B\n```\n以上です。", None),
+    ("broken-json", '説明\n```json\n{"chart_code": "digraph G { a -> b; }", }\n```', None),
+    # 旧実装との違い: ラベル内の } で図が途切れない
+    ("brace-in-label", '説明\ndigraph G { a [label="x}"]; a -> b; }',
+     {"text": "説明", "chart": 'digraph G { a [label="x}"]; a -> b; }', "suggestions": []}),
+    # 旧実装との違い: 閉じていない末尾の digraph は図にも文章にも使わない
+    ("unbalanced-dot", "説明\ndigraph G { a -> b { c }",
+     {"text": "説明", "chart": None, "suggestions": []}),
+    ("broken-json-quote", '説明\n```json\n{"chart_code": "digraph G { a [label="x}"]; }"}\n```',
+     {"text": "説明", "chart": 'digraph G { a [label="x}"]; }', "suggestions": []}),
+]
+
+
+# ストリーミングで目印がチャンクの境目で割れる例 (表示中の文章に ``` や JSON が漏れないこと)
+STREAM_SPLITS = [
+    ["説明です。\n```js", "on\n{\"chart_code\": \"digraph { A -> B; }\"}\n```\n"],
+    ["説明です。\n``", "`json\n{\"related_questions\": [\"Q1\"]}", "\n``", "`"],
+    ["手順は次の通り。\ndi", "graph G { A", " -> B; }\n以上です。"],
+]
+
+
+def check_stream(pieces):
+    """pieces を順に投入し、途中で表示される文章に図・JSON が混ざらないかを確かめる"""
+    parser = HybridResponseParser()
+    for piece in pieces:
+        parser.feed(piece)
+        shown = parser.prose
+        if any(mark in shown for mark in ("`", "chart_code", "digraph", "{")): return f"表示に漏れ: {shown!r}"
+    result = parser.close()
+    if result != parse_hybrid_response("".join(pieces)): return f"一括と結果が違う: {result!r}"
+    return None
+
+
+def check():
+    """CASES を一括・チャンク分割 (1〜8文字) の両方で確かめ、食い違いの一覧を返す"""
+    failures = []
+    for i, pieces in enumerate(STREAM_SPLITS):
+        failure = check_stream(pieces)
+        if failure: failures.append(f"stream-split-{i}: {failure}")
+    # 偽Geminiのストリーミング応答 (チャンクは固定幅なので目印が境目で割れる)
+    for chunk_chars in (3, 7, 40):
+        model = FakeGeminiModel(chunk_chars=chunk_chars)
+        failure = check_stream(list(iter_chunk_text(model.generate_content("【質問】ビザの申請は？", stream=True))))
+        if failure: failures.append(f"fake-gemini-{chunk_chars}: {failure}")
+    for name, text, expected in CASES:
+        expected = expected or legacy_parse(text)
+        got = parse_hybrid_response(text)
+        if got != expected: failures.append(f"{name}: {got!r} != {expected!r}")
+        for size in range(1, 9):
+            if chunked(text, size) != got: failures.append(f"{name}: chunk={size} で結果が変わる")
+    return failures
+
+
+def chunked(text, size):
+    parser = HybridResponseParser()
+    for i in range(0, len(text), size):
+        parser.feed(text[i:i + size])
+    return parser.close()
+
+
+def best_of(fn, text, repeat, budget):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(text)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+        # 旧実装が極端に遅い入力は繰り返さない
+        if elapsed > budget: break
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回答パーサーのベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--adversarial-size", type=int, default=20_000,
+                        help="意地悪な入力の文字数 (旧実装は2乗で遅くなるので控えめに)")
+    parser.add_argument("--chunk", type=int, default=40, help="ストリーミング投入時の1チャンクの文字数")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--budget", type=float, default=5.0, help="この秒数を超えたら繰り返しを打ち切る")
+    parser.add_argument("--check-only", action="store_true", help="解析結果の確認だけ行う")
+    args = parser.parse_args()
+
+    failures = check()
+    for failure in failures: print(f"NG {failure}")
+    print(f"check: {len(failures)} failures")
+    if failures: sys.exit(1)
+    if args.check_only: return
+
+    cases = [(f"typical-{n // 1000}k", typical(n)) for n in args.sizes]
+    cases += [(f"{name}-{args.adversarial_size // 1000}k", text)
+              for name, text in adversarial(args.adversarial_size).items()]
+
+    print(f"{'case':<28}{'chars':>10}{'legacy_ms':>12}{'single_ms':>12}{'chunked_ms':>12}{'speedup':>9}")
+    for name, text in cases:
+        legacy = best_of(legacy_parse, text, args.repeat, args.budget)
+        single = best_of(parse_hybrid_response, text, args.repeat, args.budget)
+        streamed = best_of(lambda t: chunked(t, args.chunk), text, args.repeat, args.budget)
+        print(f"{name:<28}{len(text):>10}{legacy * 1000:>12.2f}{single * 1000:>12.2f}{streamed * 1000:>12.2f}"
+              f"{legacy / single if single else 0:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""複数セッションの負荷試験 (Streamlit AppTest、オフライン)
+
+simple_app.py を AppTest で N セッション同時に動かし、同期 → SHORTCUTS → 質問 → 履歴の
+ページ送りを繰り返す。Notion は FakeNotionClient、Gemini は FakeGeminiModel に差し替える
+(遅延は引数で指定)。既定ではセッションはすべて同じプロセスで動くので、キャッシュ・マニュアルは
+1台のサーバーと同じく共有される。
+
+操作ごとの再実行時間 (p50/p95/max)・スループット・1セッションあたりの状態サイズと
+メモリ (現在の RSS の増加分) を表示し、--json で実行ごとの結果を追記する (--label で比較用の名前)。
+
+1プロセスで並行に動かすには AppTest が使う Streamlit 内部を差し替える必要がある (share_runtime)。
+確認済みの版でなければ、セッションごとに別プロセスで動かす (--mode process。キャッシュは共有されない)。
+
+    python benchmarks/bench_sessions.py --sessions 10 --actions 20 --ttft 0.5 --chunk-delay 0.02
+    python benchmarks/bench_sessions.py --sessions 30 --json bench_sessions.jsonl --label after-change
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import random
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_gemini import FakeGeminiModel
+from fake_notion import FakeNotionClient
+
+APP = os.path.join(ROOT, "simple_app.py")
+# simple_app.PRESETS と同じ (ボタンの key はラベル)
+PRESETS = ["✈️ 海外旅行保険", "💴 経費精算フロー", "📞 緊急連絡網", "🥁 和太鼓手配", "🛂 ビザ申請"]
+QUESTIONS = ["ビザの申請期限は？", "経費精算に必要な書類は？", "緊急時の連絡先は？", "海外旅行保険の加入方法は？",
+             "学生証を紛失したら？", "在留カードの更新手続きは？", "領収書が無い場合は？", "予約の締切はいつ？"]
+# share_runtime の差し替えを確認した Streamlit の版 (major.minor)
+SHARED_RUNTIME_TESTED = ("1.65",)
+
+
+def _pct(values, q):
+    if not values: return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def _rss_mb():
+    """現在の RSS (/proc が無い環境ではピーク値で代用)"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"): return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return _peak_rss_mb()
+
+
+def _peak_rss_mb():
+    # Linux の ru_maxrss は KB 単位
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def setup(args):
+    """Notion / Gemini を偽物に差し替え、アプリの設定を環境変数で与える"""
+    import notion_client
+    import notion_loader
+    import google.generativeai as genai
+    notion = FakeNotionClient(pages=args.pages, latency=args.notion_latency, seed=args.seed)
+    model = FakeGeminiModel(ttft=args.ttft, chunk_delay=args.chunk_delay, answer_chars=args.answer_chars, seed=args.seed)
+    notion_client.Client = lambda *a, **k: notion
+    # bench_sync.py と同じく、レート制限は指定があるときだけ掛ける (0 で無制限)
+    rate = args.notion_rate if args.notion_rate > 0 else 1e9
+    bucket = notion_loader.TokenBucket
+    notion_loader.TokenBucket = lambda: bucket(rate, max(1, int(min(rate, 1e6))))
+    genai.GenerativeModel = lambda *a, **k: model
+    genai.configure = lambda **k: None
+    workdir = tempfile.mkdtemp(prefix="bench_sessions_")
+    os.environ.update({
+        "NOTION_API_KEY": "bench", "NOTION_PAGE_ID": notion.root_id, "GOOGLE_API_KEY": "bench",
+        "NOTION_SYNC_STATE": os.path.join(workdir, "sync_state.json"), "MANUAL_SNAPSHOT_DIR": "",
+        "SYNC_INTERVAL": "0", "CONTEXT_CACHE": "off", "NEWS_FEEDS": "http://127.0.0.1:9/rss", "METRICS_LOG": "",
+        "HISTORY_WINDOW": str(args.history_window), "ANSWER_CACHE_SIZE": str(args.answer_cache_size),
+    })
+    # 同じ内容の警告 (ScriptRunContext が無い等) がセッション数だけ出るので抑える
+    from streamlit.logger import set_log_level
+    set_log_level(logging.ERROR)
+    return model
+
+
+def can_share_runtime():
+    """share_runtime が差し替える内部が、確認済みの版と同じ形で存在するか"""
+    import streamlit
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    if ".".join(streamlit.__version__.split(".")[:2]) not in SHARED_RUNTIME_TESTED: return False
+    return ("_instance" in vars(Runtime) and isinstance(vars(Runtime).get("instance"), classmethod)
+            and isinstance(vars(Runtime).get("exists"), classmethod) and callable(vars(ScriptCache).get("get_bytecode")))
+
+
+def share_runtime():
+    """AppTest を1プロセスで並行に動かすための準備 (1台のサーバー相当にする)
+
+    AppTest は実行のたびに Runtime を差し替えて最後に消すので、他のセッションの実行中に
+    Runtime が無くなる。消えている間は共有の Runtime を返す。スクリプトも実行ごとに
+    コンパイルし直す (並行すると ast.parse が落ちる) ので、実サーバーと同じく1度だけにする。
+    """
+    from unittest.mock import MagicMock
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    shared = MagicMock(spec=Runtime)
+    shared.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    shared.dataframe_source_mgr = DataframeSourceManager()
+    shared.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: cls._instance or shared)
+    Runtime.exists = classmethod(lambda cls: True)
+    compile_script = ScriptCache.get_bytecode
+    compiled = {}
+    lock = threading.Lock()
+
+    def get_bytecode(self, path):
+        with lock:
+            if path not in compiled: compiled[path] = compile_script(self, path)
+            return compiled[path]
+    ScriptCache.get_bytecode = get_bytecode
+
+
+def run_session(n, args, questions):
+    from streamlit.testing.v1 import AppTest
+    rng = random.Random(args.seed * 1000 + n)
+    at = AppTest.from_file(APP, default_timeout=args.timeout)
+    for key in ("NOTION_API_KEY", "NOTION_PAGE_ID", "GOOGLE_API_KEY"):
+        at.secrets[key] = os.environ[key]
+    steps = []
+
+    def step(action, fn):
+        started = time.perf_counter()
+        try:
+            fn()
+            error = str(at.exception[0].value) if at.exception else None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        steps.append((action, time.perf_counter() - started, error))
+
+    step("first_render", at.run)
+    if not at.chat_input:
+        sync = [b for b in at.button if b.label == "🔄 同期開始"]
+        if sync: step("sync", sync[0].click().run)
+    for _ in range(args.actions):
+        roll = rng.random()
+        earlier = [b for b in at.button if b.key == "load_earlier"]
+        if earlier and roll < args.history_ratio:
+            step("history", earlier[0].click().run)
+        elif roll < args.history_ratio + args.preset_ratio:
+            step("preset", at.button(key=rng.choice(PRESETS)).click().run)
+        elif at.chat_input:
+            step("question", at.chat_input[0].set_value(rng.choice(questions)).run)
+        else:
+            step("rerun", at.run)
+        if args.think: time.sleep(rng.uniform(0, args.think))
+    try:
+        state_bytes = len(pickle.dumps(at.session_state.to_dict()))
+    except Exception:
+        state_bytes = None
+    return steps, state_bytes
+
+
+_model = None
+
+
+def _process_session(n, args, questions):
+    """別プロセスで1セッション動かす (プロセスごとに偽物を用意し、呼び出し数と RSS の増加・ピークも返す)"""
+    global _model
+    if _model is None: _model = setup(args)
+    before = _rss_mb()
+    steps, state_bytes = run_session(n, args, questions)
+    return steps, state_bytes, sum(_model.calls.values()), _rss_mb() - before, _peak_rss_mb()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数セッションの負荷試験")
+    parser.add_argument("--sessions", type=int, default=5, help="同時セッション数")
+    parser.add_argument("--actions", type=int, default=10, help="1セッションあたりの操作数")
+    parser.add_argument("--ramp", type=float, default=0.05, help="セッション開始の間隔(秒)")
+    parser.add_argument("--think", type=float, default=0.0, help="操作間の待ち時間の上限(秒)")
+    parser.add_argument("--preset-ratio", type=float, default=0.4, help="SHORTCUTS を押す割合")
+    parser.add_argument("--history-ratio", type=float, default=0.15, help="「以前の会話」を開く割合")
+    parser.add_argument("--questions", help="質問のJSON Lines (batch_qa.py と同じ形式)。省略時は組み込みの質問")
+    parser.add_argument("--pages", type=int, default=200, help="偽Notionのページ数")
+    parser.add_argument("--notion-latency", type=float, default=0.0)
+    parser.add_argument("--notion-rate", type=float, default=0, help="Notionのレート制限 req/s (0 で無制限)")
+    parser.add_argument("--ttft", type=float, default=0.2, help="偽Geminiの最初の応答までの秒数")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="偽Geminiのチャンク間隔(秒)")
+    parser.add_argument("--answer-chars", type=int, default=600)
+    parser.add_argument("--history-window", type=int, default=5)
+    parser.add_argument("--answer-cache-size", type=int, default=256, help="0 で回答キャッシュを無効化")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--mode", choices=["auto", "shared", "process"], default="auto",
+                        help="shared: 1プロセスで並行 (Streamlit 内部を差し替え) / process: セッションごとに別プロセス"
+                             " (経過時間にプロセスの起動も含む) / "
+                             "auto: 確認済みの Streamlit なら shared")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--json", help="結果をJSON Linesで追記するファイル")
+    args = parser.parse_args()
+
+    questions = QUESTIONS
+    if args.questions:
+        from batch_qa import read_questions
+        questions = [q["question"] for q in read_questions(args.questions)]
+    mode = args.mode
+    if mode == "auto": mode = "shared" if can_share_runtime() else "process"
+    if mode == "shared" and not can_share_runtime():
+        print("warning: この Streamlit の版では share_runtime を確認していません", file=sys.stderr)
+
+    model = None
+    if mode == "shared":
+        model = setup(args)
+        share_runtime()
+        pool = ThreadPoolExecutor(max_workers=args.sessions)
+        run = run_session
+    else:
+        pool = ProcessPoolExecutor(max_workers=args.sessions, mp_context=multiprocessing.get_context("spawn"))
+        run = _process_session
+    rss_before = _rss_mb()
+
+    started = time.perf_counter()
+    with pool:
+        futures = []
+        for n in range(args.sessions):
+            futures.append(pool.submit(run, n, args, questions))
+            if args.ramp: time.sleep(args.ramp)
+        sessions = [f.result() for f in futures]
+    wall = time.perf_counter() - started
+
+    if mode == "shared":
+        model_calls = sum(model.calls.values())
+        rss_per_session = (_rss_mb() - rss_before) / args.sessions
+        rss_peak = _peak_rss_mb()
+    else:
+        model_calls = sum(s[2] for s in sessions)
+        rss_per_session = sum(s[3] for s in sessions) / args.sessions
+        rss_peak = max(s[4] for s in sessions)
+
+    by_action = defaultdict(list)
+    errors = defaultdict(int)
+    samples = []
+    for steps, *_ in sessions:
+        for action, seconds, error in steps:
+            by_action[action].append(seconds)
+            if error: errors[action] += 1
+            samples.append(error)
+    state_sizes = [s[1] for s in sessions if s[1] is not None]
+
+    actions = {}
+    print(f"{'action':<14}{'count':>7}{'p50_ms':>10}{'p95_ms':>10}{'max_ms':>10}{'errors':>8}")
+    for action, values in sorted(by_action.items()):
+        actions[action] = {"count": len(values), "p50_ms": round(_pct(values, 0.5) * 1000, 1),
+                           "p95_ms": round(_pct(values, 0.95) * 1000, 1), "max_ms": round(max(values) * 1000, 1),
+                           "errors": errors[action]}
+        a = actions[action]
+        print(f"{action:<14}{a['count']:>7}{a['p50_ms']:>10}{a['p95_ms']:>10}{a['max_ms']:>10}{a['errors']:>8}")
+    total = sum(len(v) for v in by_action.values())
+    result = {
+        "label": args.label, "mode": mode, "sessions": args.sessions, "reruns": total, "wall_s": round(wall, 3),
+        "reruns_per_s": round(total / wall, 2) if wall else None, "errors": sum(errors.values()),
+        "actions": actions, "model_calls": model_calls,
+        "state_kb_avg": round(sum(state_sizes) / len(state_sizes) / 1024, 1) if state_sizes else None,
+        "state_kb_max": round(max(state_sizes) / 1024, 1) if state_sizes else None,
+        "rss_peak_mb": round(rss_peak, 1), "rss_growth_per_session_mb": round(rss_per_session, 2),
+        "params": {k: v for k, v in vars(args).items() if k not in ("label", "json")},
+    }
+    print(f"\nmode={mode} sessions={args.sessions} reruns={total} wall={wall:.2f}s ({result['reruns_per_s']} reruns/s) "
+          f"errors={result['errors']} model_calls={result['model_calls']}")
+    print(f"session state avg={result['state_kb_avg']}KB max={result['state_kb_max']}KB  "
+          f"rss growth={result['rss_growth_per_session_mb']}MB/session (peak {result['rss_peak_mb']}MB)")
+    first_error = next((e for e in samples if e), None)
+    if first_error: print(f"first error: {first_error}")
+
+    if args.json:
+        result["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        with open(args.json, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""起動時間ベンチマーク (コールドスタート)
+
+毎回新しいPythonプロセスで、主要モジュールの読み込み時間と、simple_app.py を
+AppTest で動かしたときの初回描画・2回目の再実行にかかる時間を計測する。
+初回描画の時点で読み込まれている重いモジュールも表示する (遅延読み込みの確認用)。
+
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --json bench_startup.jsonl --label after-change
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["streamlit", "google.generativeai", "notion_client", "graphviz", "requests"]
+
+IMPORT_SNIPPET = """
+import sys, time, json
+started = time.perf_counter()
+import {module}
+print(json.dumps({{"import_s": time.perf_counter() - started}}))
+"""
+
+RENDER_SNIPPET = """
+import os, sys, time, json
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+os.environ.update(NEWS_FEEDS="http://127.0.0.1:9/rss", METRICS_LOG="")
+at = AppTest.from_file({app!r}, default_timeout=120)
+at.secrets["GOOGLE_API_KEY"] = "bench"
+at.secrets["NOTION_API_KEY"] = "bench"
+at.secrets["NOTION_PAGE_ID"] = "bench"
+at.run()
+first = time.perf_counter()
+at.run()
+second = time.perf_counter()
+print(json.dumps({{
+    "streamlit_import_s": imported - started,
+    "first_render_s": first - imported,
+    "rerun_s": second - first,
+    "exception": [str(e.value) for e in at.exception],
+    "loaded": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def run_python(code):
+    started = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - started
+    return json.loads(out.stdout.strip().splitlines()[-1]), wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="起動時間ベンチマーク")
+    parser.add_argument("--runs", type=int, default=3, help="計測回数 (中央値を表示)")
+    parser.add_argument("--app", default=os.path.join(ROOT, "simple_app.py"))
+    parser.add_argument("--label", default="")
+    parser.add_argument("--json", help="結果をJSON Linesで追記するファイル")
+    args = parser.parse_args()
+
+    result = {"label": args.label, "runs": args.runs, "imports": {}}
+    print(f"{'module':<24}{'import_ms':>12}")
+    for module in HEAVY_MODULES:
+        samples = [run_python(IMPORT_SNIPPET.format(module=module))[0]["import_s"] for _ in range(args.runs)]
+        result["imports"][module] = round(statistics.median(samples), 4)
+        print(f"{module:<24}{result['imports'][module] * 1000:>12.1f}")
+
+    renders = [run_python(RENDER_SNIPPET.format(app=args.app, heavy=HEAVY_MODULES)) for _ in range(args.runs)]
+    for key in ("streamlit_import_s", "first_render_s", "rerun_s"):
+        result[key] = round(statistics.median(r[key] for r, _ in renders), 4)
+    result["process_wall_s"] = round(statistics.median(wall for _, wall in renders), 4)
+    result["loaded_at_first_render"] = renders[-1][0]["loaded"]
+    result["exception"] = renders[-1][0]["exception"]
+    print()
+    print(f"{'process wall (cold)':<24}{result['process_wall_s'] * 1000:>12.1f}")
+    print(f"{'streamlit import':<24}{result['streamlit_import_s'] * 1000:>12.1f}")
+    print(f"{'first render':<24}{result['first_render_s'] * 1000:>12.1f}")
+    print(f"{'rerun':<24}{result['rerun_s'] * 1000:>12.1f}")
+    print(f"loaded at first render: {', '.join(result['loaded_at_first_render'])}")
+    if result["exception"]: print(f"exception: {result['exception']}")
+
+    if args.json:
+        result["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        with open(args.json, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
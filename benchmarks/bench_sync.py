@@ -0,0 +1,101 @@
+"""Notion同期ベンチマーク (オフライン)
+
+FakeNotionClient で合成したページツリーに対して load_recursive / load_incremental を実行し、
+pages/s・1ページあたりAPI呼び出し数・所要時間・ピークメモリを表示する。
+
+    python benchmarks/bench_sync.py --pages 1500 --latency 0.05 --workers 1 4 8
+    python benchmarks/bench_sync.py --incremental --json bench_sync.jsonl --label after-change
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_notion import FakeNotionClient
+from notion_loader import FullNotionLoader, SyncState, TokenBucket
+
+
+def run_case(args, workers, mode):
+    client = FakeNotionClient(pages=args.pages, depth=args.depth, blocks_per_page=args.blocks,
+                              table_density=args.table_density, latency=args.latency,
+                              error_rate=args.error_rate, seed=args.seed)
+    rate = args.rate if args.rate > 0 else 1e9
+    limiter = TokenBucket(rate, max(1, int(min(rate, 1e6))))
+    loader = FullNotionLoader(None, max_workers=workers, limiter=limiter, client=client)
+
+    state_path = None
+    if mode != "full":
+        fd, state_path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        os.remove(state_path)
+        # 初回同期で記録を作ってから計測
+        state = SyncState(state_path)
+        loader.load_incremental(client.root_id, lambda msg: None, state)
+        state.save()
+        if mode == "incremental-edit":
+            for page_id in client.page_ids()[::max(1, args.pages // max(1, args.edits))][:args.edits]:
+                client.touch(page_id)
+        client.calls.clear()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    if mode == "full":
+        text, count = loader.load_recursive(client.root_id, lambda msg: None)
+    else:
+        state = SyncState(state_path)
+        text, count = loader.load_incremental(client.root_id, lambda msg: None, state)
+    wall = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if state_path and os.path.exists(state_path): os.remove(state_path)
+
+    calls = sum(client.calls.values())
+    return {
+        "label": args.label, "mode": mode, "workers": workers, "pages": count,
+        "wall_s": round(wall, 3), "pages_per_s": round(count / wall, 1) if wall else None,
+        "api_calls": calls, "calls_per_page": round(calls / count, 2) if count else None,
+        "peak_mb": round(peak / 1e6, 2), "text_chars": len(text),
+        "calls_by_endpoint": dict(client.calls),
+        "params": {"pages": args.pages, "depth": args.depth, "blocks": args.blocks,
+                   "table_density": args.table_density, "latency": args.latency,
+                   "error_rate": args.error_rate, "rate": args.rate, "seed": args.seed},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Notion同期ベンチマーク")
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--blocks", type=int, default=20, help="1ページあたりのブロック数")
+    parser.add_argument("--table-density", type=float, default=0.2, help="表を含むページの割合")
+    parser.add_argument("--latency", type=float, default=0.02, help="1リクエストの擬似遅延(秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="429を返す確率")
+    parser.add_argument("--rate", type=float, default=0, help="レート制限 req/s (0 で無制限)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--incremental", action="store_true", help="差分同期 (無変更・一部変更) も計測")
+    parser.add_argument("--edits", type=int, default=10, help="一部変更ケースで更新するページ数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="")
+    parser.add_argument("--json", help="結果をJSON Linesで追記するファイル")
+    args = parser.parse_args()
+
+    modes = ["full"] + (["incremental-noop", "incremental-edit"] if args.incremental else [])
+    print(f"{'mode':<18}{'workers':>8}{'pages':>7}{'wall_s':>9}{'pages/s':>9}{'calls':>7}{'calls/pg':>9}{'peak_mb':>9}")
+    for mode in modes:
+        for workers in args.workers:
+            r = run_case(args, workers, mode)
+            print(f"{r['mode']:<18}{r['workers']:>8}{r['pages']:>7}{r['wall_s']:>9}{r['pages_per_s']:>9}"
+                  f"{r['api_calls']:>7}{r['calls_per_page']:>9}{r['peak_mb']:>9}")
+            if args.json:
+                r["timestamp"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+                with open(args.json, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
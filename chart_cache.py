@@ -0,0 +1,55 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+# フローチャート共通のガラス風スタイル
+GLASS_STYLE = 'graph [bgcolor="transparent", fontcolor="#0d47a1", ranksep=0.6]; node [color="#2196f3", fontcolor="#0d47a1", style="filled,rounded", fillcolor="#e3f2fd", fixedsize=false, width=0, height=0, margin="0.2,0.1"]; edge [color="#2196f3"];'
+
+
+def apply_glass_style(chart):
+    """digraph の先頭にスタイルを差し込む (保存前に1回だけ行う)"""
+    chart = chart.replace('digraph {', f'digraph {{ {GLASS_STYLE}')
+    chart = chart.replace('digraph G {', f'digraph G {{ {GLASS_STYLE}')
+    return chart
+
+
+class SvgCache:
+    """DOT→SVG のレイアウト結果キャッシュ (内容ハッシュ単位・合計サイズ上限でLRU破棄)"""
+    def __init__(self, max_bytes=20_000_000):
+        self.max_bytes = max_bytes
+        self.available = True
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def render(self, dot):
+        """(svg, error) を返す。dot コマンドが無い環境では (None, None)"""
+        key = hashlib.sha256(dot.encode("utf-8")).hexdigest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        if not self.available: return None, None
+        import graphviz
+        try:
+            svg = graphviz.Source(dot).pipe(format="svg", encoding="utf-8")
+            entry = (svg[svg.find("<svg"):], None)
+        except graphviz.ExecutableNotFound:
+            self.available = False
+            return None, None
+        except Exception as e:
+            # 不正なDOTは失敗として記録し、再描画のたびに再試行しない
+            entry = (None, str(e).splitlines()[0][:200] if str(e) else type(e).__name__)
+        self._store(key, entry)
+        return entry
+
+    def _store(self, key, entry):
+        size = len(entry[0] or entry[1] or "")
+        with self._lock:
+            if key in self._entries: return
+            self._entries[key] = entry
+            self._size += size
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, (svg, error) = self._entries.popitem(last=False)
+                self._size -= len(svg or error or "")
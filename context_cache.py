@@ -0,0 +1,119 @@
+import time
+import datetime
+import threading
+from collections import OrderedDict
+from metrics import METRICS
+
+# 登録に失敗した接頭辞を再試行するまでの秒数
+RETRY_FAILED_AFTER = 300
+# 登録済みの接頭辞がサーバー側で消えたことを示すエラーコード (NotFound / PermissionDenied)。
+# 429 などの一時的なエラーでは接頭辞を捨てない
+PREFIX_GONE_CODES = (403, 404)
+
+
+def prefix_gone(error):
+    return getattr(error, "code", None) in PREFIX_GONE_CODES
+
+
+class GeminiContextBackend:
+    """Gemini の Context Caching (CachedContent) に接頭辞を登録する"""
+    def __init__(self, model_name, min_chars=8000):
+        self.model_name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+        # これより短い接頭辞はAPIの最小トークン数に届かないので登録しない
+        self.min_chars = min_chars
+
+    def create(self, key, prefix, ttl):
+        from google.generativeai import caching
+        return caching.CachedContent.create(model=self.model_name, display_name=key, contents=[prefix],
+                                            ttl=datetime.timedelta(seconds=ttl))
+
+    def model(self, handle):
+        import google.generativeai as genai
+        return genai.GenerativeModel.from_cached_content(handle)
+
+    def delete(self, handle):
+        handle.delete()
+
+
+class _PrefixedModel:
+    def __init__(self, model, prefix):
+        self.model = model
+        self.prefix = prefix
+
+    def generate_content(self, contents, **kwargs):
+        return self.model.generate_content(self.prefix + contents, **kwargs)
+
+
+class LocalContextBackend:
+    """テスト・オフライン用: 接頭辞を手元に持ち、呼び出しのたびに質問部分の前へ付け足す"""
+    def __init__(self, model_factory, min_chars=0):
+        self.model_factory = model_factory
+        self.min_chars = min_chars
+        self.created = []
+        self.deleted = []
+
+    def create(self, key, prefix, ttl):
+        self.created.append(key)
+        return {"key": key, "prefix": prefix}
+
+    def model(self, handle):
+        return _PrefixedModel(self.model_factory(), handle["prefix"])
+
+    def delete(self, handle):
+        self.deleted.append(handle["key"])
+
+
+class ContextCache:
+    """版ごとの固定接頭辞を1回だけ登録し、以後の質問では登録済みハンドルを使い回す"""
+    def __init__(self, backend, ttl=3600, max_entries=2):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._failed = {}
+        self._lock = threading.Lock()
+
+    def model(self, key, prefix):
+        """接頭辞登録済みのモデル。短すぎる・登録に失敗した場合は None (全文を送る)"""
+        if len(prefix) < self.backend.min_chars: return None
+        now = time.time()
+        # 登録は時間がかかるので、同じ接頭辞の同時登録を避けるためロックしたまま行う
+        with self._lock:
+            entry = self._entries.get(key)
+            # サーバー側の期限切れ直前のハンドルは使わず登録し直す
+            if entry is not None and now - entry[0] < self.ttl * 0.9:
+                self._entries.move_to_end(key)
+                METRICS.incr("context_cache.hits")
+                return entry[2]
+            if now - self._failed.get(key, 0) < RETRY_FAILED_AFTER: return None
+            try:
+                with METRICS.timer("context_cache.create"):
+                    handle = self.backend.create(key, prefix, self.ttl)
+            except Exception:
+                METRICS.incr("context_cache.errors")
+                self._failed[key] = now
+                return None
+            if entry is not None: self._delete(entry[1])
+            # モデルもハンドルごとに1つだけ作って使い回す
+            model = self.backend.model(handle)
+            self._entries[key] = (now, handle, model)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                _, (_, old, _) = self._entries.popitem(last=False)
+                self._delete(old)
+            METRICS.incr("context_cache.creates")
+            return model
+
+    def invalidate(self, key):
+        """ハンドルが使えなくなったとき (サーバー側で削除・期限切れ) に呼ぶ。次の質問で登録し直す"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            METRICS.incr("context_cache.invalidations")
+            self._delete(entry[1])
+
+    def _delete(self, handle):
+        try:
+            self.backend.delete(handle)
+        except Exception:
+            pass
@@ -0,0 +1,41 @@
+
+
+class DocRecord:
+    """同期中に流れる1件分の構造化データ (ページ見出し or ブロック)"""
+    __slots__ = ("page_id", "title", "path", "block_type", "text", "rows")
+
+    def __init__(self, page_id, title, path, block_type, text="", rows=None):
+        self.page_id = page_id
+        self.title = title
+        self.path = path
+        self.block_type = block_type
+        self.text = text
+        self.rows = rows
+
+    def to_compact(self):
+        """差分同期の記録用 (ページ単位の情報は持たない)"""
+        return [self.block_type, self.text, self.rows]
+
+    @classmethod
+    def from_compact(cls, page_id, title, path, item):
+        block_type, text, rows = item
+        return cls(page_id, title, path, block_type, text, rows)
+
+
+def render_text(records):
+    """従来のプロンプト用テキストを断片ごとに生成"""
+    for r in records:
+        b_type = r.block_type
+        if b_type == "page": yield f"\n\n{'='*20}\n【ページ: {r.text}】\n"
+        elif b_type == "paragraph": yield r.text + "\n"
+        elif "heading" in b_type: yield f"\n■{r.text}\n"
+        elif "list_item" in b_type: yield f"・{r.text}\n"
+        elif b_type == "callout": yield f"💡{r.text}\n"
+        elif b_type == "toggle": yield f"▼{r.text}\n"
+        elif b_type == "image": yield f"\n[画像あり: {r.text}]\n"
+        elif b_type == "table":
+            yield "\n【以下の表データあり】\n"
+            if r.text: yield r.text + "\n"
+            for cells in r.rows or []:
+                yield " | ".join(cells) + "\n"
+        elif b_type == "child_page": yield f"[リンク: {r.text}]\n"
@@ -0,0 +1,65 @@
+import re
+import json
+import time
+import random
+import threading
+from collections import Counter
+from types import SimpleNamespace
+
+QUESTION_RE = re.compile(r"【質問】(.*)", re.S)
+
+
+class FakeModelError(Exception):
+    """google.api_core の ResourceExhausted 相当 (429)"""
+    code = 429
+
+
+class _Response:
+    def __init__(self, pieces, usage, delay):
+        self._pieces = pieces
+        self._delay = delay
+        self.usage_metadata = usage
+        self.text = "".join(pieces)
+
+    def __iter__(self):
+        for piece in self._pieces:
+            if self._delay: time.sleep(self._delay)
+            yield SimpleNamespace(text=piece)
+
+
+class FakeGeminiModel:
+    """genai.GenerativeModel の代替 (プロンプトから決定的な回答を作り、遅延・429を注入できる)"""
+    def __init__(self, ttft=0.0, chunk_delay=0.0, chunk_chars=40, answer_chars=600, error_rate=0.0, seed=0):
+        self.ttft = ttft
+        self.chunk_delay = chunk_delay
+        self.chunk_chars = chunk_chars
+        self.answer_chars = answer_chars
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.prompt_chars = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        with self._lock:
+            self.calls["stream" if stream else "generate"] += 1
+            self.prompt_chars += len(contents)
+            fail = self.error_rate and self._rng.random() < self.error_rate
+        if self.ttft: time.sleep(self.ttft)
+        if fail: raise FakeModelError("429 Resource has been exhausted")
+        text = self.answer(contents)
+        usage = SimpleNamespace(prompt_token_count=len(contents), candidates_token_count=len(text),
+                                cached_content_token_count=0)
+        if not stream: return _Response([text], usage, 0)
+        pieces = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)]
+        return _Response(pieces, usage, self.chunk_delay)
+
+    def answer(self, contents):
+        """プロンプト末尾の質問に応じた回答 (文章 + JSONブロック)"""
+        m = QUESTION_RE.search(contents)
+        question = m.group(1).strip() if m else "質問"
+        line = f"「{question}」について、焦らず一緒に確認しましょう。\n"
+        body = line * max(1, self.answer_chars // len(line))
+        block = {"chart_code": 'digraph G { rankdir=TB; "確認" -> "申請" -> "完了"; }',
+                 "related_questions": [f"{question}の期限は？", f"{question}の必要書類は？"]}
+        return f"{body}\n```json\n{json.dumps(block, ensure_ascii=False)}\n```\n"
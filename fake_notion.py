@@ -0,0 +1,148 @@
+import time
+import random
+import threading
+from collections import Counter
+from types import SimpleNamespace
+
+WORDS = ["申請", "書類", "留学生", "ビザ", "経費", "精算", "締切", "担当", "窓口", "保険",
+         "手続き", "確認", "提出", "連絡", "緊急", "予約", "学生証", "在留カード", "領収書", "承認"]
+
+
+class FakeAPIError(Exception):
+    """notion_client の HTTP エラーと同じ属性 (status / code / headers) を持つ例外"""
+    def __init__(self, status, code, message="", headers=None):
+        super().__init__(message or code)
+        self.status = status
+        self.code = code
+        self.headers = headers or {}
+
+
+def _rt(text):
+    return {"rich_text": [{"plain_text": text}]}
+
+
+class FakeNotionClient:
+    """FullNotionLoader が使う notion_client.Client の代替 (合成ページツリー・遅延・429注入)"""
+    def __init__(self, pages=200, depth=4, blocks_per_page=20, table_density=0.2, database_density=0.1,
+                 latency=0.0, error_rate=0.0, retry_after=0.05, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._children = {}
+        self._databases = {}
+        self._build(pages, depth, blocks_per_page, table_density, database_density)
+        self.pages = SimpleNamespace(retrieve=self._retrieve_page)
+        self.blocks = SimpleNamespace(children=SimpleNamespace(list=self._list_children))
+        self.databases = SimpleNamespace(query=self._query_database)
+
+    # --- 合成データ ---
+    def _id(self):
+        self._seq += 1
+        return f"{self._seq:08x}-0000-4000-8000-000000000000"
+
+    def _sentence(self):
+        return "、".join(self._rng.choice(WORDS) for _ in range(self._rng.randint(3, 10))) + "。"
+
+    def _build(self, pages, depth, blocks_per_page, table_density, database_density):
+        rng = self._rng
+        self._seq = 0
+        self.root_id = self._id()
+        levels = {self.root_id: 0}
+        kids = {self.root_id: []}
+        for _ in range(max(0, pages - 1)):
+            parent = rng.choice([p for p, d in levels.items() if d < depth] or [self.root_id])
+            page_id = self._id()
+            levels[page_id] = levels[parent] + 1
+            kids[page_id] = []
+            kids[parent].append(page_id)
+        for page_id in levels:
+            self._meta[page_id] = {"object": "page", "id": page_id, "last_edited_time": "2024-01-01T00:00:00.000Z",
+                                   "in_trash": False,
+                                   "properties": {"title": {"type": "title", "title": [{"plain_text": self._title(page_id)}]}}}
+            blocks = []
+            for i in range(blocks_per_page):
+                kind = rng.random()
+                if i % 8 == 0: blocks.append(self._block("heading_2", _rt(self._sentence())))
+                elif kind < 0.1: blocks.append(self._toggle())
+                elif kind < 0.2: blocks.append(self._block("bulleted_list_item", _rt(self._sentence())))
+                elif kind < 0.25: blocks.append(self._block("callout", _rt(self._sentence())))
+                else: blocks.append(self._block("paragraph", _rt(self._sentence())))
+            if rng.random() < table_density:
+                blocks.append(self._table(rng.randint(5, 150)))
+            linked = [c for c in kids[page_id] if rng.random() >= database_density]
+            rows = [c for c in kids[page_id] if c not in linked]
+            for child in linked:
+                blocks.append(self._block("child_page", {"title": self._title(child)}, block_id=child, has_children=True))
+            if rows:
+                db = self._block("child_database", {"title": "DB"}, has_children=True)
+                self._databases[db["id"]] = rows
+                blocks.append(db)
+            self._children[page_id] = blocks
+
+    def _title(self, page_id):
+        return f"ページ{page_id[:8]}"
+
+    def _block(self, b_type, body, block_id=None, has_children=False):
+        return {"object": "block", "id": block_id or self._id(), "type": b_type, b_type: body, "has_children": has_children}
+
+    def _toggle(self):
+        block = self._block("toggle", _rt(self._sentence()), has_children=True)
+        self._children[block["id"]] = [self._block("paragraph", _rt(self._sentence())) for _ in range(3)]
+        return block
+
+    def _table(self, n_rows):
+        block = self._block("table", {"table_width": 3}, has_children=True)
+        self._children[block["id"]] = [
+            self._block("table_row", {"cells": [[{"plain_text": self._rng.choice(WORDS)}] for _ in range(3)]})
+            for _ in range(n_rows)]
+        return block
+
+    # --- 変更操作 (差分同期の計測用) ---
+    def touch(self, page_id, when="2024-02-01T00:00:00.000Z"):
+        self._meta[page_id]["last_edited_time"] = when
+
+    def page_ids(self):
+        return list(self._meta)
+
+    # --- API 面 ---
+    def _enter(self, name):
+        with self._lock:
+            self.calls[name] += 1
+            fail = self.error_rate and self._rng.random() < self.error_rate
+        if self.latency: time.sleep(self.latency)
+        if fail:
+            raise FakeAPIError(429, "rate_limited", headers={"retry-after": str(self.retry_after)})
+
+    def _paginate(self, items, start_cursor, page_size):
+        start = int(start_cursor or 0)
+        size = min(page_size or 100, 100)
+        end = start + size
+        return {"object": "list", "results": items[start:end], "has_more": end < len(items),
+                "next_cursor": str(end) if end < len(items) else None}
+
+    def _retrieve_page(self, page_id, **kwargs):
+        self._enter("pages.retrieve")
+        if page_id not in self._meta:
+            raise FakeAPIError(404, "object_not_found")
+        return self._meta[page_id]
+
+    def _list_children(self, block_id, start_cursor=None, page_size=None, **kwargs):
+        self._enter("blocks.children.list")
+        if block_id not in self._children:
+            raise FakeAPIError(404, "object_not_found")
+        return self._paginate(self._children[block_id], start_cursor, page_size)
+
+    def _query_database(self, database_id, start_cursor=None, page_size=None, **kwargs):
+        self._enter("databases.query")
+        if database_id not in self._databases:
+            raise FakeAPIError(404, "object_not_found")
+        rows = [self._meta[p] for p in self._databases[database_id]]
+        return self._paginate(rows, start_cursor, page_size)
+
+    def search(self, start_cursor=None, page_size=None, **kwargs):
+        self._enter("search")
+        return self._paginate(list(self._meta.values()), start_cursor, page_size)
@@ -0,0 +1,63 @@
+import time
+import hashlib
+import threading
+
+
+class ManualCorpus:
+    """同期済みマニュアル本体 (不変・全セッションで共有)"""
+    __slots__ = ("text", "page_count", "synced_at", "version", "pages")
+
+    def __init__(self, text, page_count, synced_at=None, pages=None):
+        object.__setattr__(self, "text", text)
+        object.__setattr__(self, "page_count", page_count)
+        object.__setattr__(self, "synced_at", synced_at or time.time())
+        object.__setattr__(self, "version", hashlib.sha256(text.encode("utf-8")).hexdigest()[:16])
+        # ページごとの (page_id, title, 開始, 終了) 位置 (スナップショット保存用。無ければ全体で1ページ扱い)
+        object.__setattr__(self, "pages", tuple(pages or ()))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ManualCorpus is immutable")
+
+    def iter_pages(self):
+        """(page_id, title, 本文) を順に返す"""
+        if not self.pages:
+            yield None, None, self.text
+            return
+        for page_id, title, start, end in self.pages:
+            yield page_id, title, self.text[start:end]
+
+    def iter_texts(self):
+        yield self.text
+
+
+class CorpusStore:
+    """プロセス共有のマニュアル置き場 (最新版1つだけを保持)"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._current = None
+        self._generation = 0
+
+    def current(self):
+        return self._current
+
+    def get(self, version):
+        corpus = self._current
+        return corpus if corpus is not None and corpus.version == version else None
+
+    def publish(self, corpus):
+        """新しい版を公開 (内容が同じなら既存オブジェクトを使い回す)"""
+        with self._lock:
+            if self._current is None or self._current.version != corpus.version:
+                self._current = corpus
+            self._generation += 1
+            return self._current
+
+    def refresh(self, build):
+        """build() -> ManualCorpus か (text, page_count) で同期。同時に押された場合も実行は1回だけ"""
+        started = self._generation
+        with self._sync_lock:
+            if self._generation != started and self._current is not None:
+                return self._current
+            result = build()
+            return self.publish(result if isinstance(result, ManualCorpus) else ManualCorpus(*result))
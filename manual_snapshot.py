@@ -0,0 +1,114 @@
+import os
+import json
+import mmap
+import zlib
+import threading
+
+# スナップショット形式の版 (読み込み側と合わなければ使わない)
+SNAPSHOT_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+COMPRESS_LEVEL = 6
+
+
+def read_manifest(directory):
+    """manifest.json (無い・壊れている・形式違いなら None)"""
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("format") == SNAPSHOT_FORMAT else None
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def save_snapshot(corpus, directory):
+    """同期済みマニュアルをページごとに圧縮して保存する。同じ版が保存済みなら何もしない
+
+    pages-<版>.bin (ページごとの zlib 圧縮本文を連結) と index-<版>.json ([page_id, title, 位置, 長さ])
+    を書いてから manifest.json を差し替えるので、途中で落ちても前の版が読める。
+    """
+    current = read_manifest(directory)
+    if current and current["version"] == corpus.version: return False
+    os.makedirs(directory, exist_ok=True)
+    pages_name, index_name = f"pages-{corpus.version}.bin", f"index-{corpus.version}.json"
+    index = []
+    offset = chars = 0
+    tmp = os.path.join(directory, pages_name + ".tmp")
+    with open(tmp, "wb") as f:
+        for page_id, title, text in corpus.iter_pages():
+            chars += len(text)
+            data = zlib.compress(text.encode("utf-8"), COMPRESS_LEVEL)
+            f.write(data)
+            index.append([page_id, title, offset, len(data)])
+            offset += len(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(directory, pages_name))
+    _write_atomic(os.path.join(directory, index_name), json.dumps(index, ensure_ascii=False).encode("utf-8"))
+    manifest = {"format": SNAPSHOT_FORMAT, "version": corpus.version, "synced_at": corpus.synced_at,
+                "page_count": corpus.page_count, "chars": chars, "compression": "zlib",
+                "pages_file": pages_name, "pages_bytes": offset, "index_file": index_name}
+    _write_atomic(os.path.join(directory, MANIFEST_NAME), json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8"))
+    # 古い版のファイルを片付ける (開いたままの古い版は POSIX ならそのまま読める)
+    for name in os.listdir(directory):
+        if name.startswith(("pages-", "index-")) and name not in (pages_name, index_name):
+            try: os.remove(os.path.join(directory, name))
+            except OSError: pass
+    return True
+
+
+def load_snapshot(directory):
+    """保存済みスナップショットを開く (無い・壊れている場合は None)"""
+    manifest = read_manifest(directory)
+    if manifest is None: return None
+    try:
+        return SnapshotCorpus(directory, manifest)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+class SnapshotCorpus:
+    """スナップショットから開いたマニュアル (ManualCorpus と同じ属性。ページ本文は使うときに mmap から展開)"""
+    def __init__(self, directory, manifest):
+        self.version = manifest["version"]
+        self.page_count = manifest["page_count"]
+        self.synced_at = manifest["synced_at"]
+        self.chars = manifest["chars"]
+        with open(os.path.join(directory, manifest["index_file"]), encoding="utf-8") as f:
+            self.index = [tuple(entry) for entry in json.load(f)]
+        path = os.path.join(directory, manifest["pages_file"])
+        if os.path.getsize(path) != manifest["pages_bytes"]:
+            raise ValueError(f"{path} のサイズが manifest と一致しません")
+        with open(path, "rb") as f:
+            # 空ファイルは mmap できない
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if manifest["pages_bytes"] else b""
+        self._text = None
+        self._lock = threading.Lock()
+
+    @property
+    def text(self):
+        """全文 (全文をプロンプトに入れる設定のときだけ必要になる。初回に1度だけ展開)"""
+        if self._text is None:
+            with self._lock:
+                if self._text is None: self._text = "".join(self.iter_texts())
+        return self._text
+
+    def page_text(self, i):
+        _, _, offset, length = self.index[i]
+        return zlib.decompress(self._data[offset:offset + length]).decode("utf-8")
+
+    def iter_pages(self):
+        for i, (page_id, title, _, _) in enumerate(self.index):
+            yield page_id, title, self.page_text(i)
+
+    def iter_texts(self):
+        for i in range(len(self.index)):
+            yield self.page_text(i)
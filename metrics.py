@@ -0,0 +1,110 @@
+import re
+import json
+import time
+import threading
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+# 1指標あたり保持する計測値の数 (古いものから捨てる)
+MAX_SAMPLES = 2000
+MAX_EVENTS = 1000
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values: return None
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+
+class Metrics:
+    """プロセス共有の軽量メトリクス (タイマー・カウンター・質問ごとのイベント)"""
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self._samples = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+        self._totals = defaultdict(lambda: [0, 0.0])
+        self._counters = defaultdict(float)
+        self._events = deque(maxlen=MAX_EVENTS)
+        self._lock = threading.Lock()
+
+    def observe(self, name, value):
+        with self._lock:
+            self._samples[name].append(value)
+            total = self._totals[name]
+            total[0] += 1
+            total[1] += value
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def event(self, kind, **fields):
+        """1件分の記録 (質問ごとの所要時間・サイズなど)。log_path があればJSON Linesで追記"""
+        record = {"ts": round(time.time(), 3), "kind": kind, **fields}
+        with self._lock:
+            self._events.append(record)
+        if self.log_path:
+            try:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError:
+                pass
+
+    def summary(self):
+        with self._lock:
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+            totals = {name: list(t) for name, t in self._totals.items()}
+            counters = dict(self._counters)
+        timers = {}
+        for name, values in sorted(samples.items()):
+            count, total = totals[name]
+            timers[name] = {"count": count, "sum": total, "p50": _percentile(values, 0.5),
+                            "p95": _percentile(values, 0.95), "max": values[-1] if values else None}
+        return {"timers": timers, "counters": dict(sorted(counters.items()))}
+
+    def events(self):
+        with self._lock:
+            return list(self._events)
+
+    def to_jsonl(self):
+        return "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in self.events())
+
+    def to_prometheus(self, prefix="rsjp"):
+        """Prometheus テキスト形式 (タイマーは summary、カウンターは counter)"""
+        lines = []
+        data = self.summary()
+        for name, t in data["timers"].items():
+            metric = f"{prefix}_{_metric_name(name)}_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for q, key in ((0.5, "p50"), (0.95, "p95")):
+                if t[key] is not None: lines.append(f'{metric}{{quantile="{q}"}} {t[key]:.6f}')
+            lines.append(f"{metric}_sum {t['sum']:.6f}")
+            lines.append(f"{metric}_count {t['count']}")
+        for name, value in data["counters"].items():
+            metric = f"{prefix}_{_metric_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            # :g は有効6桁に丸めてしまうので repr で出す
+            lines.append(f"{metric} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+            self._counters.clear()
+            self._events.clear()
+
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+# アプリ全体で共有するインスタンス
+METRICS = Metrics()
@@ -0,0 +1,96 @@
+import time
+import datetime
+import threading
+import requests
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from metrics import METRICS
+
+# Google News RSSで立命館関連の最新記事を取得
+DEFAULT_FEEDS = ["https://news.google.com/rss/search?q=立命館+大学+学園+附属&hl=ja&gl=JP&ceid=JP:ja"]
+
+
+def parse_feed(content, limit=10):
+    """RSSを {title, link, date, ts} のリストに変換"""
+    root = ET.fromstring(content)
+    news_items = []
+    for item in root.findall(".//item")[:limit]:
+        title = item.find("title").text
+        link = item.find("link").text
+        pubDate = item.find("pubDate").text
+        try:
+            dt = datetime.datetime.strptime(pubDate, '%a, %d %b %Y %H:%M:%S %Z')
+            date_str = dt.strftime('%m/%d')
+            ts = dt.timestamp()
+        except:
+            date_str = ""
+            ts = 0.0
+
+        if " - " in title: title = title.split(" - ")[0]
+        news_items.append({"title": title, "link": link, "date": date_str, "ts": ts})
+    return news_items
+
+
+class NewsFeedCache:
+    """ニュースの共有キャッシュ (期限切れでも手元の内容を返し、裏で条件付きGETで更新)"""
+    def __init__(self, feeds=None, ttl=600, timeout=3, limit=10):
+        self.feeds = list(feeds or DEFAULT_FEEDS)
+        self.ttl = ttl
+        self.timeout = timeout
+        self.limit = limit
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.feeds), pool_maxsize=len(self.feeds))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._feed_state = {url: {"etag": None, "modified": None, "items": []} for url in self.feeds}
+        self._items = []
+        self._fetched_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def items(self):
+        """メモリ上の記事を即座に返す (古ければバックグラウンド更新を起動)"""
+        if time.time() - self._fetched_at > self.ttl:
+            self._start_refresh()
+        return self._items
+
+    def _start_refresh(self):
+        with self._lock:
+            if self._refreshing: return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def refresh(self):
+        """全フィードを並列取得して記事一覧を差し替える"""
+        try:
+            with METRICS.timer("news.refresh"), ThreadPoolExecutor(max_workers=len(self.feeds)) as pool:
+                list(pool.map(self._fetch, self.feeds))
+            merged, seen = [], set()
+            for url in self.feeds:
+                for item in self._feed_state[url]["items"]:
+                    if item["link"] in seen: continue
+                    seen.add(item["link"])
+                    merged.append(item)
+            if len(self.feeds) > 1:
+                merged.sort(key=lambda item: item["ts"], reverse=True)
+            self._items = merged[:self.limit]
+        finally:
+            self._fetched_at = time.time()
+            with self._lock:
+                self._refreshing = False
+
+    def _fetch(self, url):
+        state = self._feed_state[url]
+        headers = {}
+        if state["etag"]: headers["If-None-Match"] = state["etag"]
+        if state["modified"]: headers["If-Modified-Since"] = state["modified"]
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 200:
+                state["items"] = parse_feed(response.content, self.limit)
+                state["etag"] = response.headers.get("ETag")
+                state["modified"] = response.headers.get("Last-Modified")
+            # 304 Not Modified や失敗時は前回の記事をそのまま使う
+        except Exception:
+            pass
@@ -0,0 +1,398 @@
+import os
+import json
+import time
+import random
+import threading
+from collections import deque
+from operator import attrgetter
+from concurrent.futures import ThreadPoolExecutor
+from documents import DocRecord, render_text
+from metrics import METRICS
+
+# Notion API の平均レート制限 (約 3 req/s)
+NOTION_RATE_LIMIT = 3.0
+NOTION_BURST = 3
+MAX_RETRIES = 5
+# 一覧系APIの1回あたり取得件数 (Notion の上限)
+PAGE_SIZE = 100
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# 連携に共有されていない・削除済みのページ
+INACCESSIBLE_STATUS = {403, 404}
+
+
+class TokenBucket:
+    """スレッド共有のトークンバケット (Retry-After 受信時は全体を一時停止)"""
+    def __init__(self, rate=NOTION_RATE_LIMIT, capacity=NOTION_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+class IncompleteSyncError(RuntimeError):
+    """一部のページ・ブロックが取得できなかった同期 (この結果は公開しない)"""
+
+
+def _retry_after(error, attempt):
+    """Retry-After ヘッダー優先、なければ指数バックオフ + ジッター"""
+    headers = getattr(error, "headers", None) or {}
+    try:
+        value = headers.get("retry-after") or headers.get("Retry-After")
+        if value is not None:
+            return float(value)
+    except (TypeError, ValueError):
+        pass
+    return min(30.0, 0.5 * (2 ** attempt)) + random.uniform(0, 0.25)
+
+
+def _transient(error):
+    """再試行すれば通る見込みのある失敗か (429/5xx・タイムアウト・接続断)"""
+    # notion_client / httpx は重いので、失敗したときに初めて読み込む
+    from httpx import TransportError
+    from notion_client.errors import RequestTimeoutError
+    if isinstance(error, (RequestTimeoutError, TransportError)): return True
+    return getattr(error, "status", None) in RETRYABLE_STATUS
+
+
+def _norm(page_id):
+    return page_id.replace("-", "")
+
+
+class SyncState:
+    """ページ単位の同期記録 (last_edited_time / 本文 / 子リンク) をJSONで永続化"""
+    def __init__(self, path):
+        self.path = path
+        self.root_id = None
+        self.pages = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.root_id = data.get("root_id")
+            self.pages = data.get("pages", {})
+        except (OSError, ValueError):
+            pass
+
+    def reset(self, root_id):
+        self.root_id = root_id
+        self.pages = {}
+
+    def save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"root_id": self.root_id, "pages": self.pages}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+class FullNotionLoader:
+    def __init__(self, api_key, max_workers=1, limiter=None, client=None):
+        if client is None:
+            # notion_client の読み込みは重いので、実際に同期するときまで遅らせる
+            from notion_client import Client
+            client = Client(auth=api_key)
+        self.notion = client
+        self.visited_ids = set()
+        self.max_workers = max(1, max_workers)
+        self.limiter = limiter or TokenBucket()
+        self._block_pool = None
+        # 取得に失敗して読み飛ばしたページ・ブロックのID (list.append はスレッド安全)
+        self.failed_ids = []
+        # 直近の同期で得たページごとの本文位置 (_render 参照)
+        self.page_spans = []
+
+    def _call(self, endpoint, *args, **kwargs):
+        """レート制限付きAPI呼び出し (429/5xx・タイムアウト・接続断はバックオフして再試行)"""
+        fn = attrgetter(endpoint)(self.notion)
+        for attempt in range(MAX_RETRIES + 1):
+            self.limiter.acquire()
+            METRICS.incr(f"notion.{endpoint}.calls")
+            try:
+                with METRICS.timer(f"notion.{endpoint}"):
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                if not _transient(e) or attempt == MAX_RETRIES:
+                    METRICS.incr(f"notion.{endpoint}.errors")
+                    raise
+                METRICS.incr(f"notion.{endpoint}.retries")
+                self.limiter.pause(_retry_after(e, attempt))
+
+    def _failed(self, item_id, error):
+        """読み飛ばした箇所を記録する。一時的な失敗 (再試行切れの 429/5xx・タイムアウト・接続断) だけを
+        failed_ids に残し、毎回必ず失敗するもの (見えない 403/404 など 4xx・応答形式の不一致) は従来通り飛ばす"""
+        if _transient(error):
+            self.failed_ids.append(item_id)
+        elif getattr(error, "status", None) is not None:
+            METRICS.incr("notion.inaccessible")
+        else:
+            METRICS.incr("notion.unexpected_errors")
+
+    def load_recursive(self, start_id, progress_callback):
+        """ページツリーを幅優先で読み込む (max_workers > 1 なら並列取得、出力順は従来通り)"""
+        return self._render(self._crawl(start_id, progress_callback, self._read_page_records))
+
+    def load_incremental(self, start_id, progress_callback, state, strict=False):
+        """last_edited_time が変わったページだけブロックを再取得する差分同期
+
+        strict=True なら取得に失敗した箇所があった時点で IncompleteSyncError (state も更新しない)
+        """
+        if state.root_id != _norm(start_id):
+            state.reset(_norm(start_id))
+        edited = self._fetch_edit_times()
+        fresh = {}
+        reused, fetched = [], []
+
+        def read(page_id, ancestors):
+            key = _norm(page_id)
+            meta = edited.get(key)
+            if meta is None:
+                # 検索インデックスに無いページは個別に確認 (削除・ゴミ箱は除外)
+                try: meta = self._call("pages.retrieve", page_id)
+                except Exception as e:
+                    if getattr(e, "status", None) in INACCESSIBLE_STATUS: return [], []
+                    raise
+                if meta.get("in_trash") or meta.get("archived"): return [], []
+            record = state.pages.get(key)
+            if record and record.get("blocks") is not None and record["last_edited_time"] == meta.get("last_edited_time"):
+                title = record["title"]
+                path = ancestors + (title or "Untitled",)
+                records = [DocRecord.from_compact(page_id, title, path, item) for item in record["blocks"]]
+                child_ids = self._expand_links(record["links"])
+                reused.append(key)
+            else:
+                records, child_ids, links = self._read_page(page_id, ancestors, page=meta)
+                title = records[0].text if records and records[0].block_type == "page" else None
+                record = {"last_edited_time": meta.get("last_edited_time"), "title": title,
+                          "blocks": [r.to_compact() for r in records], "links": links}
+                fetched.append(key)
+            fresh[key] = record
+            return records, child_ids
+
+        full_text, count = self._render(self._crawl(start_id, progress_callback, read))
+        self.stats = {"reused": len(reused), "fetched": len(fetched), "failures": len(self.failed_ids)}
+        if strict and self.failed_ids:
+            raise IncompleteSyncError(f"{len(self.failed_ids)} 件のページ・ブロックを取得できませんでした")
+        # 到達しなかったページ (削除・移動済み) は記録から落とす
+        state.pages = fresh
+        return full_text, count
+
+    def _render(self, pages):
+        """本文を連結し、ページごとの (page_id, title, 開始, 終了) 位置を page_spans に残す"""
+        parts = []
+        spans = []
+        count = 0
+        size = 0
+        for records in pages:
+            count += 1
+            start = size
+            for part in render_text(records):
+                parts.append(part)
+                size += len(part)
+            spans.append((records[0].page_id, records[0].title, start, size))
+        self.page_spans = spans
+        return "".join(parts), count
+
+    def _fetch_edit_times(self):
+        """search API で全ページの last_edited_time を一括取得 (失敗時は空)"""
+        edited = {}
+        cursor = None
+        try:
+            while True:
+                kwargs = {"filter": {"property": "object", "value": "page"}, "page_size": 100}
+                if cursor: kwargs["start_cursor"] = cursor
+                res = self._call("search", **kwargs)
+                for page in res["results"]:
+                    if not (page.get("in_trash") or page.get("archived")):
+                        edited[_norm(page["id"])] = page
+                if not res.get("has_more"): break
+                cursor = res.get("next_cursor")
+        except Exception: return {}
+        return edited
+
+    def _expand_links(self, links):
+        """保存済みリンクから子ページIDを復元 (データベースは行だけ再取得)"""
+        child_ids = []
+        for kind, link_id in links:
+            if kind == "page": child_ids.append(link_id)
+            else: child_ids.extend(self._query_database(link_id))
+        return child_ids
+
+    def _query_database(self, database_id):
+        """データベースの全行IDを取得 (100件ずつ has_more を辿る)
+
+        notion-client 3 以降は databases.query が無く、データベース配下のデータソースごとに問い合わせる
+        """
+        ids = []
+        try:
+            if hasattr(self.notion.databases, "query"):
+                ids.extend(self._query_rows("databases.query", database_id=database_id))
+            else:
+                database = self._call("databases.retrieve", database_id)
+                for source in database.get("data_sources", []):
+                    ids.extend(self._query_rows("data_sources.query", data_source_id=source["id"]))
+        except Exception as e: self._failed(database_id, e)
+        return ids
+
+    def _query_rows(self, endpoint, **target):
+        """一覧系の query を最後まで辿って行 (ページ) のIDを返す"""
+        ids = []
+        cursor = None
+        while True:
+            kwargs = dict(target, page_size=PAGE_SIZE)
+            if cursor: kwargs["start_cursor"] = cursor
+            res = self._call(endpoint, **kwargs)
+            ids.extend(row["id"] for row in res["results"] if row.get("object", "page") == "page")
+            if not res.get("has_more"): return ids
+            cursor = res.get("next_cursor")
+
+    def _list_children(self, block_id):
+        """子ブロックを全件取得。途中で失敗したら (取得済み分, False)"""
+        results = []
+        cursor = None
+        try:
+            while True:
+                kwargs = {"block_id": block_id, "page_size": PAGE_SIZE}
+                if cursor: kwargs["start_cursor"] = cursor
+                blocks = self._call("blocks.children.list", **kwargs)
+                results.extend(blocks["results"])
+                if not blocks.get("has_more"): return results, True
+                cursor = blocks.get("next_cursor")
+        except Exception as e:
+            self._failed(block_id, e)
+            return results, False
+
+    def _fetch_block_tree(self, page_id):
+        """ページ内のブロックツリーを階層ごとにまとめて取得 (トグル・カラム・同期ブロック・表も展開)"""
+        roots, _ = self._list_children(page_id)
+        level = roots
+        while level:
+            targets = [b for b in level if b.get("has_children") and b["type"] not in ("child_page", "child_database")]
+            if not targets: break
+            sources = []
+            for b in targets:
+                synced_from = (b.get("synced_block") or {}).get("synced_from") or {}
+                sources.append(synced_from.get("block_id") or b["id"])
+            # 同じ階層の部分木は独立なので並列に取得 (リクエスト数は共有リミッターで制御)
+            pool = self._block_pool
+            results = list(pool.map(self._list_children, sources)) if pool else [self._list_children(src) for src in sources]
+            level = []
+            for b, (children, ok) in zip(targets, results):
+                b["children"] = children
+                if not ok: b["children_failed"] = True
+                level.extend(children)
+        return roots
+
+    def _crawl(self, start_id, progress_callback, read):
+        """read(page_id, ancestors) -> (records, child_ids) を幅優先で回し、ページごとの records を順に返す"""
+        self.visited_ids = set()
+        self.failed_ids = []
+        ancestors = {start_id: ()}
+        queue = deque([start_id])
+        pending = deque()
+        count = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as block_pool:
+            self._block_pool = block_pool if self.max_workers > 1 else None
+            try:
+                while queue or pending:
+                    # キュー順に先読みし、結果は必ず投入順に取り出す
+                    while queue and len(pending) < self.max_workers:
+                        current_id = queue.popleft()
+                        if current_id in self.visited_ids: continue
+                        self.visited_ids.add(current_id)
+                        pending.append((current_id, pool.submit(read, current_id, ancestors[current_id])))
+                    if not pending: continue
+                    current_id, future = pending.popleft()
+                    records, child_ids = future.result()
+                    path = records[0].path if records else ancestors[current_id]
+                    for child_id in child_ids:
+                        ancestors.setdefault(child_id, path)
+                    queue.extend(child_ids)
+                    if records:
+                        count += 1
+                        progress_callback(f"Syncing... {count} pages")
+                        yield records
+            finally:
+                self._block_pool = None
+
+    def _read_page_detailed(self, page_id):
+        records, child_ids, _ = self._read_page(page_id, ())
+        return "".join(render_text(records)), child_ids
+
+    def _read_page_records(self, page_id, ancestors):
+        records, child_ids, _ = self._read_page(page_id, ancestors)
+        return records, child_ids
+
+    def _read_page(self, page_id, ancestors, page=None):
+        records = []
+        child_ids = []
+        links = []
+        title = None
+        try:
+            try:
+                if page is None: page = self._call("pages.retrieve", page_id)
+                title = "Untitled"
+                if "properties" in page:
+                    for prop in page["properties"].values():
+                        if prop["type"] == "title" and prop["title"]:
+                            title = prop["title"][0]["plain_text"]
+                            break
+            except Exception as e: self._failed(page_id, e)
+            path = ancestors + (title or "Untitled",)
+            if title is not None:
+                records.append(DocRecord(page_id, title, path, "page", title))
+            blocks = self._fetch_block_tree(page_id)
+            self._block_records(blocks, DocRecord(page_id, title, path, None), records, child_ids, links)
+        except Exception as e: self._failed(page_id, e)
+        return records, child_ids, links
+
+    def _block_records(self, blocks, page, records, child_ids, links):
+        """ブロックツリーを文書順の DocRecord に変換 (子ページ・DBの行IDも集める)"""
+        for block in blocks:
+            b_type = block["type"]
+            content = ""
+            if "rich_text" in block.get(b_type, {}):
+                content = "".join([t["plain_text"] for t in block[b_type]["rich_text"]])
+            record = None
+            if b_type in ("paragraph", "callout", "toggle") or "heading" in b_type or "list_item" in b_type:
+                record = content
+            elif b_type == "image":
+                caption = ""
+                if "caption" in block["image"] and block["image"]["caption"]:
+                    caption = "".join([t["plain_text"] for t in block["image"]["caption"]])
+                record = caption
+            elif b_type == "table":
+                rows = [["".join([t["plain_text"] for t in cell]) for cell in row["table_row"]["cells"]]
+                        for row in block.get("children", []) if "table_row" in row]
+                failed = "(表の読み込みに失敗)" if block.get("children_failed") else ""
+                records.append(DocRecord(page.page_id, page.title, page.path, b_type, failed, rows))
+                continue
+            elif b_type == "child_page":
+                child_ids.append(block["id"])
+                links.append(("page", block["id"]))
+                record = block["child_page"]["title"]
+            elif b_type == "child_database":
+                links.append(("database", block["id"]))
+                child_ids.extend(self._query_database(block["id"]))
+            if record is not None:
+                records.append(DocRecord(page.page_id, page.title, page.path, b_type, record))
+            # トグル・カラム・同期ブロックなどの入れ子
+            if block.get("children"):
+                self._block_records(block["children"], page, records, child_ids, links)
@@ -0,0 +1,80 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from chart_cache import apply_glass_style
+from metrics import METRICS
+
+
+class Prewarmer:
+    """同期後の先回り生成 (よく押される質問の回答・フローチャートを裏で回答キャッシュに入れておく)
+
+    回答キャッシュのキー (key_for(question, corpus)) は版IDを含むので、版が変われば古い結果は使われない。
+    前の版の分は新しい版の生成が終わったところでキャッシュから消す。
+    """
+    def __init__(self, cache, engine_factory, key_for, svg_cache=None, concurrency=2):
+        self.cache = cache
+        self.engine_factory = engine_factory
+        self.key_for = key_for
+        self.svg_cache = svg_cache
+        self.concurrency = max(1, concurrency)
+        self.version = None
+        self.state = "idle"
+        self.total = 0
+        self.done = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_duration = None
+        self._keys = []
+        self._lock = threading.Lock()
+
+    def start(self, corpus, questions):
+        """corpus の版で questions を裏で生成する (同じ版は1回だけ。新しい版が来たら古い版の残りは打ち切る)"""
+        questions = list(dict.fromkeys(q for q in questions if q))
+        with self._lock:
+            if corpus is None or not questions: return False
+            # 同じ版は1回だけ (失敗が出た版は次の同期でやり直す)
+            if corpus.version == self.version and self.state != "error": return False
+            self.version, self.state = corpus.version, "running"
+            self.total, self.done, self.failures, self.last_error = len(questions), 0, 0, None
+        threading.Thread(target=self._run, args=(corpus, questions), name="prewarm", daemon=True).start()
+        return True
+
+    def _run(self, corpus, questions):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="prewarm") as pool:
+            keys = [key for key in pool.map(lambda q: self._warm(corpus, q), questions) if key]
+        with self._lock:
+            if self.version != corpus.version: return
+            stale, self._keys = self._keys, keys
+            self.state = "ok" if not self.failures else "error"
+            self.last_duration = time.perf_counter() - started
+        # 同じ版をやり直した場合は今回作った分を消さない
+        self.cache.discard(set(stale) - set(keys))
+        METRICS.observe("prewarm.total", self.last_duration)
+
+    def _warm(self, corpus, question):
+        """1問分を生成してキャッシュに入れる (キャッシュ済み・生成中なら結果を待つだけ)"""
+        if self.version != corpus.version: return None
+        key = self.key_for(question, corpus)
+        try:
+            data, cached = self.cache.get_or_compute(key, lambda: self.engine_factory().answer(corpus, question, stream=False)[0])
+            chart = data.get("chart")
+            # 画面と同じスタイルを当ててから描画しておけば、押したときは SVG キャッシュから出る
+            if self.svg_cache is not None and chart and "digraph" in chart:
+                self.svg_cache.render(apply_glass_style(chart))
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+            METRICS.incr("prewarm.failures")
+            return None
+        METRICS.incr("prewarm.hits" if cached else "prewarm.answers")
+        with self._lock:
+            self.done += 1
+        return key
+
+    def status(self):
+        """管理画面向けの状態"""
+        return {"state": self.state, "version": self.version, "done": self.done, "total": self.total,
+                "failures": self.failures, "last_error": self.last_error,
+                "last_duration_s": round(self.last_duration, 2) if self.last_duration is not None else None}
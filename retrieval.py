@@ -0,0 +1,125 @@
+import re
+import math
+import heapq
+import unicodedata
+from collections import Counter, defaultdict
+
+# 1チャンクの最大文字数 (これを超える節は段落単位で分割)
+MAX_CHUNK_CHARS = 1200
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+PAGE_RE = re.compile(r"^【ページ: (.*)】$")
+
+
+class Chunk:
+    """マニュアルの1区画 (ページ見出し + ■見出し単位)"""
+    __slots__ = ("index", "page", "heading", "text")
+
+    def __init__(self, index, page, heading, text):
+        self.index = index
+        self.page = page
+        self.heading = heading
+        self.text = text
+
+
+def split_pages(texts, max_chars=MAX_CHUNK_CHARS):
+    """ページごとの本文から分割 (全文を1つの文字列にまとめずに済む。結果は split_chunks と同じ)"""
+    chunks = []
+    for text in texts:
+        for chunk in split_chunks(text, max_chars):
+            chunk.index = len(chunks)
+            chunks.append(chunk)
+    return chunks
+
+
+def split_chunks(text, max_chars=MAX_CHUNK_CHARS):
+    """【ページ: …】と■見出しの境界でマニュアルを分割する"""
+    chunks = []
+    page, heading, lines = "", "", []
+
+    def flush():
+        body = "\n".join(lines).strip()
+        lines.clear()
+        if not body: return
+        header = f"【ページ: {page}】" + (f"\n■{heading}" if heading else "")
+        # 長すぎる節は段落の切れ目で分ける
+        piece = []
+        size = 0
+        for para in body.split("\n"):
+            if piece and size + len(para) > max_chars:
+                chunks.append(Chunk(len(chunks), page, heading, header + "\n" + "\n".join(piece)))
+                piece, size = [], 0
+            piece.append(para)
+            size += len(para) + 1
+        if piece:
+            chunks.append(Chunk(len(chunks), page, heading, header + "\n" + "\n".join(piece)))
+
+    for line in text.split("\n"):
+        m = PAGE_RE.match(line)
+        if m:
+            flush()
+            page, heading = m.group(1), ""
+        elif line.startswith("■"):
+            flush()
+            heading = line[1:]
+        elif line.startswith("=" * 20):
+            continue
+        else:
+            lines.append(line)
+    flush()
+    return chunks
+
+
+def tokenize(text):
+    """日本語向け: 正規化した文字バイグラム (空白・記号は区切り)"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for run in re.findall(r"\w+", text):
+        if len(run) == 1: tokens.append(run)
+        else: tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def estimate_tokens(text):
+    """トークン数の概算 (日本語は1文字≒1トークンとして安全側に見積もる)"""
+    return len(text)
+
+
+class ManualIndex:
+    """チャンク単位の BM25 転置インデックス"""
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for chunk in chunks:
+            tf = Counter(tokenize(chunk.text))
+            self.lengths.append(sum(tf.values()))
+            for term, n in tf.items():
+                self.postings[term].append((chunk.index, n))
+        self.avg_len = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def search(self, query, top_k=8):
+        n_docs = len(self.chunks)
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting: continue
+            idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for idx, tf in posting:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[idx] / self.avg_len)
+                scores[idx] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = heapq.nlargest(top_k, scores.items(), key=lambda kv: kv[1])
+        return [(self.chunks[idx], score) for idx, score in best]
+
+    def select_context(self, query, top_k=8, token_budget=12000):
+        """上位チャンクを予算内で選び、元の文書順に連結して返す"""
+        picked = []
+        used = 0
+        for chunk, _ in self.search(query, top_k):
+            cost = estimate_tokens(chunk.text)
+            if used + cost > token_budget: continue
+            picked.append(chunk)
+            used += cost
+        picked.sort(key=lambda c: c.index)
+        return "\n\n".join(c.text for c in picked)
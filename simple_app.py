@@ -1,16 +1,22 @@
 import os
+import hmac
 import time
-import json
-import re
 import datetime
-import requests
-import xml.etree.ElementTree as ET
 import streamlit as st
 import streamlit.components.v1 as components
 from dotenv import load_dotenv
-from notion_client import Client
-import google.generativeai as genai
-from graphviz import Digraph
+from notion_loader import FullNotionLoader, SyncState
+from sync_scheduler import SyncScheduler
+from manual_corpus import CorpusStore, ManualCorpus
+from manual_snapshot import load_snapshot, save_snapshot
+from answer_engine import AnswerEngine
+from answer_cache import AnswerCache, answer_key
+from prewarm import Prewarmer
+from news_feed import DEFAULT_FEEDS, NewsFeedCache
+from metrics import METRICS
+from chart_cache import SvgCache, apply_glass_style
+from styles import APP_CSS
+from context_cache import ContextCache, GeminiContextBackend, LocalContextBackend
 
 # ==========================================
 # 0. APIキー読み込み設定
@@ -23,6 +29,8 @@ if "NOTION_PAGE_ID" in st.secrets:
     os.environ["NOTION_PAGE_ID"] = st.secrets["NOTION_PAGE_ID"]
 if "NOTION_DATABASE_ID" in st.secrets and "NOTION_PAGE_ID" not in os.environ:
     os.environ["NOTION_PAGE_ID"] = st.secrets["NOTION_DATABASE_ID"]
+if "ADMIN_TOKEN" in st.secrets:
+    os.environ["ADMIN_TOKEN"] = st.secrets["ADMIN_TOKEN"]
 
 # --- 1. 設定 ---
 load_dotenv()
@@ -37,275 +45,278 @@ st.set_page_config(
 NOTION_KEY = os.getenv("NOTION_API_KEY")
 NOTION_PAGE_ID = os.getenv("NOTION_PAGE_ID")
 GOOGLE_KEY = os.getenv("GOOGLE_API_KEY")
+# Notion同期の並列数 (1 なら逐次)
+NOTION_SYNC_WORKERS = int(os.getenv("NOTION_SYNC_WORKERS", "4"))
+# 差分同期の記録ファイル
+NOTION_SYNC_STATE = os.getenv("NOTION_SYNC_STATE", ".notion_sync_state.json")
+# 同期済みマニュアルの保存先 (再起動時はここから即座に復元。空なら保存しない)
+MANUAL_SNAPSHOT_DIR = os.getenv("MANUAL_SNAPSHOT_DIR", ".manual_snapshot")
+# 裏での定期同期の間隔(秒)と揺らぎ (0 なら「同期開始」ボタンのみ)
+SYNC_INTERVAL = int(os.getenv("SYNC_INTERVAL", "0"))
+SYNC_JITTER = float(os.getenv("SYNC_JITTER", "0.1"))
+# スナップショットから復元したら裏で1回差分同期する (0 なら復元した版のまま)
+SYNC_ON_RESTORE = os.getenv("SYNC_ON_RESTORE", "1") != "0"
+# 質問ごとにプロンプトへ入れるマニュアル区画 (TOP_K=0 なら全文を送る)
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "12000"))
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# 固定の接頭辞 (ルール + 全文マニュアル) を版ごとに登録して使い回す: gemini / local / off
+CONTEXT_CACHE = os.getenv("CONTEXT_CACHE", "gemini")
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "3600"))
+CONTEXT_CACHE_MIN_CHARS = int(os.getenv("CONTEXT_CACHE_MIN_CHARS", "8000"))
+# 回答をストリーミング表示するか (0 で従来の一括表示)
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") != "0"
+# 同期後に裏で回答を作っておく質問 (SHORTCUTS に加える分はカンマ区切り) と並列数 (PREWARM=0 で無効)
+PREWARM = os.getenv("PREWARM", "1") != "0"
+PREWARM_QUESTIONS = [q.strip() for q in os.getenv("PREWARM_QUESTIONS", "").split(",") if q.strip()]
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", "2"))
+# スナップショットから復元した版も起動時に用意するか (起動のたびに課金される。回答キャッシュをディスクに置く場合向け)
+PREWARM_ON_RESTORE = os.getenv("PREWARM_ON_RESTORE", "0") == "1"
+# 回答キャッシュ (件数・有効秒数・ディスク保存先。保存先が空ならメモリのみ)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_DIR = os.getenv("ANSWER_CACHE_DIR", "")
+# ニュースRSS (複数はカンマ区切り) と再取得間隔(秒)
+NEWS_FEEDS = [u.strip() for u in os.getenv("NEWS_FEEDS", "").split(",") if u.strip()] or DEFAULT_FEEDS
+NEWS_TTL = int(os.getenv("NEWS_TTL", "600"))
+# 計測: 管理パネル表示 (ADMIN_TOKEN を設定すれば ?admin=<トークン> の画面だけに表示) と質問ごとの記録ファイル (JSON Lines)
+SHOW_ADMIN = os.getenv("ADMIN_PANEL", "0") == "1"
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# フローチャートSVGキャッシュの上限 (バイト)
+CHART_CACHE_BYTES = int(os.getenv("CHART_CACHE_BYTES", "20000000"))
+# チャット履歴を一度に描画する往復数 (「以前の会話」で同じ数ずつ追加表示)
+HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", "10"))
+METRICS.log_path = os.getenv("METRICS_LOG") or None
+
+# 左カラムの SHORTCUTS (ラベルの絵文字の後ろが質問文)
+PRESETS = ["✈️ 海外旅行保険", "💴 経費精算フロー", "📞 緊急連絡網", "🥁 和太鼓手配", "🛂 ビザ申請"]
+
+def preset_question(label):
+    return label.split(" ", 1)[1] if " " in label else label
 
 # --- 2. データ取得関数 ---
+@st.cache_resource
+def get_news_cache():
+    """全セッション共有のニュースキャッシュ (起動時に裏で初回取得を開始)"""
+    cache = NewsFeedCache(NEWS_FEEDS, NEWS_TTL)
+    cache.items()
+    return cache
+
 def get_ritsumeikan_news():
-    """立命館関連ニュース取得 (RSS)"""
-    # Google News RSSで立命館関連の最新記事を取得
-    url = "https://news.google.com/rss/search?q=立命館+大学+学園+附属&hl=ja&gl=JP&ceid=JP:ja"
-    try:
-        response = requests.get(url, timeout=3)
-        if response.status_code == 200:
-            root = ET.fromstring(response.content)
-            news_items = []
-            for item in root.findall(".//item")[:10]:
-                title = item.find("title").text
-                link = item.find("link").text
-                pubDate = item.find("pubDate").text
-                try:
-                    dt = datetime.datetime.strptime(pubDate, '%a, %d %b %Y %H:%M:%S %Z')
-                    date_str = dt.strftime('%m/%d')
-                except:
-                    date_str = ""
-                
-                if " - " in title: title = title.split(" - ")[0]
-                news_items.append({"title": title, "link": link, "date": date_str})
-            return news_items
-    except: return []
-    return []
+    """立命館関連ニュース取得 (RSS、常にメモリから返す)"""
+    with METRICS.timer("news.get"):
+        return get_news_cache().items()
 
 # --- 3. デザイン (Pro Dashboard CSS) ---
-st.markdown("""
-<style>
-    @import url('https://fonts.googleapis.com/css2?family=Montserrat:wght@400;600;800&family=Noto+Sans+JP:wght@400;700&display=swap');
-    
-    .stApp {
-        background: #f4f6f9;
-        color: #1a237e;
-        font-family: 'Noto Sans JP', sans-serif;
-    }
-    header, #MainMenu, footer {visibility: hidden;}
-    .block-container { padding-top: 1rem; padding-bottom: 0rem; }
-
-    /* カラム共通 */
-    [data-testid="column"] {
-        background: rgba(255, 255, 255, 0.9);
-        border-radius: 12px;
-        padding: 15px;
-        box-shadow: 0 4px 15px rgba(0,0,0,0.03);
-        border: 1px solid white;
-        height: 100%;
-    }
-
-    /* --- ヘッダー --- */
-    .saas-header {
-        display: flex; justify-content: space-between; align-items: center;
-        background: linear-gradient(135deg, #7f1118, #b7102e); /* 立命館カラー */
-        padding: 20px 30px; border-radius: 16px; color: white;
-        box-shadow: 0 8px 32px rgba(127, 17, 24, 0.25); margin-bottom: 15px;
-    }
-    .saas-logo { font-family: 'Montserrat', sans-serif; font-size: 1.6em; font-weight: 800; letter-spacing: 1px; }
-    .saas-logo span { font-weight: 400; opacity: 0.8; margin-left: 8px; font-size: 0.8em; }
-    .status-indicator { background: rgba(255,255,255,0.1); padding: 5px 12px; border-radius: 20px; font-size: 0.75em; }
-
-    /* --- 右カラム: 情報パネル --- */
-    .info-card {
-        background: #263238; color: white;
-        border-radius: 10px; padding: 15px; margin-bottom: 15px;
-        font-family: 'Montserrat', sans-serif;
-        box-shadow: 0 4px 10px rgba(0,0,0,0.1);
-        border: 1px solid #37474f;
-    }
-    .card-label { color: #b0bec5; font-size: 0.7em; font-weight: 700; margin-bottom: 5px; text-transform: uppercase; }
-    .card-main { font-size: 1.8em; font-weight: 700; line-height: 1.0; }
-    .card-sub { font-size: 0.8em; color: #90a4ae; margin-top: 2px; }
-    
-    /* 天気行 */
-    .weather-row {
-        display: flex; justify-content: space-between; align-items: center;
-        margin-top: 10px; border-top: 1px solid #455a64; padding-top: 8px; font-size: 0.9em;
-    }
-
-    /* --- ニュースバナー & リスト --- */
-    .news-wrapper {
-        border-radius: 10px; overflow: hidden;
-        box-shadow: 0 4px 10px rgba(0,0,0,0.05);
-        margin-bottom: 20px; border: 1px solid #e0e0e0; background: white;
-    }
-    .news-banner {
-        /* 立命館スクールカラーに変更 */
-        background: linear-gradient(90deg, #7f1118, #b7102e);
-        color: white; padding: 10px 15px; font-family: 'Noto Sans JP', sans-serif;
-        font-weight: 700; font-size: 0.9em; display: flex; align-items: center;
-    }
-    .news-banner span { margin-left: auto; font-size: 0.7em; opacity: 0.8; background: rgba(255,255,255,0.2); padding: 2px 6px; border-radius: 4px; font-family: 'Montserrat', sans-serif;}
-    
-    .news-content { max-height: 500px; overflow-y: auto; padding: 0; }
-    .news-item {
-        display: block; padding: 10px 15px; border-bottom: 1px solid #f5f5f5;
-        text-decoration: none; color: #333; font-size: 0.85em; transition: 0.2s; line-height: 1.4;
-    }
-    .news-item:hover { background: #fef1f2; color: #b7102e; padding-left: 18px; }
-    .news-date { color: #999; font-size: 0.85em; margin-right: 8px; font-family: monospace; }
-
-    /* --- チャットエリア --- */
-    div[data-testid="stChatMessage"]:nth-of-type(odd) { flex-direction: row-reverse; text-align: right; }
-    div[data-testid="stChatMessage"]:nth-of-type(odd) div[data-testid="stMarkdownContainer"] {
-        background: linear-gradient(135deg, #e3f2fd, #bbdefb); color: #0d47a1;
-        padding: 12px 20px; border-radius: 18px 18px 0 18px; text-align: left;
-    }
-    div[data-testid="stChatMessage"]:nth-of-type(even) div[data-testid="stMarkdownContainer"] {
-        background: white; border: 1px solid #e0e0e0;
-        padding: 15px 25px; border-radius: 18px 18px 18px 0; width: 100%;
-    }
-    .stChatMessage .stAvatar { display: none; }
-
-    /* 入力欄 */
-    .stChatInput { position: fixed; bottom: 30px; left: 50%; transform: translateX(-50%); width: 50%; z-index: 1000; }
-    .stChatInput textarea {
-        border-radius: 28px !important; border: 1px solid #ddd !important;
-        padding: 15px 25px !important; min-height: 60px !important;
-        box-shadow: 0 10px 40px rgba(0,0,0,0.1) !important;
-    }
-    .stChatInput textarea:focus { border-color: #b7102e !important; }
-
-    /* 履歴リンク */
-    .history-link a {
-        display: block; padding: 8px 12px; margin-bottom: 6px; color: #555;
-        text-decoration: none; background: #f5f5f5; border-radius: 8px; font-size: 0.85em;
-        border-left: 3px solid transparent; transition: 0.2s;
-    }
-    .history-link a:hover { background: white; color: #b7102e; border-left: 3px solid #b7102e; }
-
-</style>
-""", unsafe_allow_html=True)
+# CSSは styles.py で1度だけ圧縮し、再実行のたびには送り直すだけにする
+st.markdown(APP_CSS, unsafe_allow_html=True)
 
 # --- 4. クラス定義 ---
-class FullNotionLoader:
-    def __init__(self, api_key):
-        self.notion = Client(auth=api_key)
-        self.visited_ids = set()
-
-    def load_recursive(self, start_id, progress_callback):
-        self.visited_ids = set()
-        full_text = ""
-        queue = [start_id]
-        count = 0
-        while queue:
-            current_id = queue.pop(0)
-            if current_id in self.visited_ids: continue
-            self.visited_ids.add(current_id)
-            page_text, child_ids = self._read_page_detailed(current_id)
-            if page_text:
-                full_text += page_text
-                count += 1
-                progress_callback(f"Syncing... {count} pages")
-            queue.extend(child_ids)
-            time.sleep(0.1) 
-        return full_text, count
-
-    def _read_page_detailed(self, page_id):
-        text_part = ""
-        child_ids = []
-        try:
-            try:
-                page = self.notion.pages.retrieve(page_id)
-                title = "Untitled"
-                if "properties" in page:
-                    for prop in page["properties"].values():
-                        if prop["type"] == "title" and prop["title"]:
-                            title = prop["title"][0]["plain_text"]
-                            break
-                text_part += f"\n\n{'='*20}\n【ページ: {title}】\n"
+@st.cache_resource
+def get_notion_client():
+    """全セッション共有の Notion クライアント (接続を使い回す)"""
+    from notion_client import Client
+    return Client(auth=NOTION_KEY)
+
+@st.cache_resource
+def get_corpus_store():
+    """全セッション共有のマニュアル置き場 (保存済みスナップショットがあれば起動時に復元)"""
+    store = CorpusStore()
+    if MANUAL_SNAPSHOT_DIR:
+        with METRICS.timer("snapshot.load"):
+            snapshot = load_snapshot(MANUAL_SNAPSHOT_DIR)
+        if snapshot is not None: store.publish(snapshot)
+    return store
+
+def build_manual(progress):
+    """Notion から差分同期してマニュアル本文を作る (取得漏れがあれば例外にして公開しない)"""
+    loader = FullNotionLoader(NOTION_KEY, max_workers=NOTION_SYNC_WORKERS, client=get_notion_client())
+    state = SyncState(NOTION_SYNC_STATE)
+    started = time.perf_counter()
+    all_text, count = loader.load_incremental(NOTION_PAGE_ID, progress, state, strict=True)
+    state.save()
+    corpus = ManualCorpus(all_text, count, pages=loader.page_spans)
+    if MANUAL_SNAPSHOT_DIR:
+        with METRICS.timer("snapshot.save"):
+            save_snapshot(corpus, MANUAL_SNAPSHOT_DIR)
+    METRICS.observe("sync.total", time.perf_counter() - started)
+    METRICS.event("sync", pages=count, chars=len(all_text), **loader.stats)
+    return corpus
+
+@st.cache_resource
+def get_prewarmer():
+    """全セッション共有の先回り生成係 (SHORTCUTS と PREWARM_QUESTIONS の回答・図を裏で用意)"""
+    return Prewarmer(get_answer_cache(), get_answer_engine, cache_key, get_svg_cache(), PREWARM_CONCURRENCY)
+
+def prewarm(corpus):
+    """公開された版の SHORTCUTS 等を裏で生成する (同じ版は1回だけ)"""
+    if PREWARM and GOOGLE_KEY:
+        get_prewarmer().start(corpus, [preset_question(p) for p in PRESETS] + PREWARM_QUESTIONS)
+
+def retry_prewarm(corpus):
+    """版が変わらなかった同期のあと、前回の先回り生成で失敗が出ていれば同じ版でやり直す"""
+    if PREWARM and GOOGLE_KEY and get_prewarmer().state == "error": prewarm(corpus)
+
+@st.cache_resource
+def get_sync_scheduler():
+    """全セッション共有の同期係 (SYNC_INTERVAL > 0 なら起動直後から裏で定期同期)"""
+    store = get_corpus_store()
+    scheduler = SyncScheduler(store, build_manual, SYNC_INTERVAL, SYNC_JITTER, on_publish=prewarm, on_resync=retry_prewarm)
+    if PREWARM_ON_RESTORE and store.current() is not None: prewarm(store.current())
+    if NOTION_KEY and NOTION_PAGE_ID:
+        if SYNC_INTERVAL > 0: scheduler.start()
+        # 復元した版は表示しつつ、Notion 側の更新を裏で取り込む (スナップショットを唯一の情報源にしない)
+        elif SYNC_ON_RESTORE and store.current() is not None: scheduler.run_in_background()
+    return scheduler
+
+@st.fragment(run_every=2)
+def render_sync_progress(scheduler):
+    """裏の同期が終わるまで進捗を表示し、最初の版が公開されたら画面全体を再実行する"""
+    if scheduler.store.current() is not None: st.rerun()
+    status = scheduler.status()
+    if status["state"] == "error": st.error(f"同期に失敗しました (再試行します): {status['last_error']}")
+    else: st.caption(f"🔄 同期中... {status['progress']}")
+
+@st.cache_resource
+def get_answer_cache():
+    """全セッション共有の回答キャッシュ"""
+    return AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_DIR or None)
+
+@st.cache_resource
+def get_answer_engine():
+    """全セッション共有の回答エンジン (検索インデックス・コンテキストキャッシュ込み)"""
+    # google.generativeai は読み込みが重いので最初の質問まで遅らせ、モデルはプロセスで1つだけ作る
+    import google.generativeai as genai
+    genai.configure(api_key=GOOGLE_KEY)
+    model = genai.GenerativeModel(GEMINI_MODEL)
+    model_factory = lambda: model
+    contexts = None
+    if CONTEXT_CACHE == "gemini":
+        contexts = ContextCache(GeminiContextBackend(GEMINI_MODEL, CONTEXT_CACHE_MIN_CHARS), CONTEXT_CACHE_TTL)
+    elif CONTEXT_CACHE == "local":
+        contexts = ContextCache(LocalContextBackend(model_factory, CONTEXT_CACHE_MIN_CHARS), CONTEXT_CACHE_TTL)
+    # 検索インデックスは渡されたマニュアルそのものから版ごとに作る (エンジン内で直近2版を保持)
+    return AnswerEngine(model_factory, RETRIEVAL_TOP_K, RETRIEVAL_TOKEN_BUDGET, contexts)
+
+def cache_key(question, corpus):
+    """回答キャッシュのキー (同じ版・同じプロンプト・同じモデルと検索件数のときだけ使い回す)"""
+    return answer_key(question, corpus.version, GEMINI_MODEL, RETRIEVAL_TOP_K)
+
+@st.cache_resource
+def get_svg_cache():
+    """全セッション共有のフローチャートSVGキャッシュ"""
+    return SvgCache(CHART_CACHE_BYTES)
+
+def render_chart(dot):
+    """DOTはサーバー側で1度だけSVG化し、以降はキャッシュから表示"""
+    with METRICS.timer("chart.render"):
+        svg, error = get_svg_cache().render(dot)
+        if svg: st.markdown(f"<div class='flowchart'>{svg}</div>", unsafe_allow_html=True)
+        elif error is None: st.graphviz_chart(dot)  # dot コマンドが無い環境はブラウザ側で描画
+
+def add_turn(question):
+    """1往復分の記録を追加し、HISTORY のリンクも追記する"""
+    turns = st.session_state.chat_history
+    i = len(turns)
+    turns.append({"question": question, "answer": None, "chart": None, "suggestions": []})
+    label = (question[:9] + "..") if len(question) > 9 else question
+    st.session_state.history_links += f"<div class='history-link'><a href='#msg-{i}'>📄 {label}</a></div>"
+    return turns[-1]
+
+def render_turn(i, turn):
+    """質問と回答 (本文・フローチャート・次の質問) を描画"""
+    st.markdown(f"<div id='msg-{i}'></div>", unsafe_allow_html=True)
+    with st.chat_message("user"):
+        st.markdown(turn["question"])
+    if turn["answer"] is None: return
+    with st.chat_message("assistant"):
+        st.markdown(turn["answer"])
+        if turn["chart"]:
+            st.markdown("---")
+            st.caption("📊 Flowchart")
+            try: render_chart(turn["chart"])
             except: pass
-            has_more = True
-            cursor = None
-            while has_more:
-                try: blocks = self.notion.blocks.children.list(block_id=page_id, start_cursor=cursor)
-                except: break
-                for block in blocks["results"]:
-                    b_type = block["type"]
-                    content = ""
-                    if "rich_text" in block.get(b_type, {}):
-                        content = "".join([t["plain_text"] for t in block[b_type]["rich_text"]])
-                    if b_type == "paragraph": text_part += content + "\n"
-                    elif "heading" in b_type: text_part += f"\n■{content}\n"
-                    elif "list_item" in b_type: text_part += f"・{content}\n"
-                    elif b_type == "callout": text_part += f"💡{content}\n"
-                    elif b_type == "image":
-                        caption = ""
-                        if "caption" in block["image"] and block["image"]["caption"]:
-                            caption = "".join([t["plain_text"] for t in block["image"]["caption"]])
-                        text_part += f"\n[画像あり: {caption}]\n"
-                    elif b_type == "table":
-                        text_part += "\n【以下の表データあり】\n"
-                        try:
-                            rows = self.notion.blocks.children.list(block_id=block["id"])
-                            for row in rows["results"]:
-                                if "table_row" in row:
-                                    cells = [ "".join([t["plain_text"] for t in cell]) for cell in row["table_row"]["cells"]]
-                                    text_part += " | ".join(cells) + "\n"
-                        except: text_part += "(表の読み込みに失敗)\n"
-                    if b_type == "child_page":
-                        child_ids.append(block["id"])
-                        text_part += f"[リンク: {block['child_page']['title']}]\n"
-                    elif b_type == "child_database":
-                        try:
-                            db_query = self.notion.databases.query(database_id=block["id"])
-                            for row in db_query["results"]: child_ids.append(row["id"])
-                        except: pass
-                has_more = blocks.get("has_more", False)
-                cursor = blocks.get("next_cursor")
-        except Exception: pass
-        return text_part, child_ids
-
-def parse_hybrid_response(text):
-    """テキストとJSONを分離し、テキスト側に残った生コードを強力に削除する"""
-    result = {"text": "", "chart": None, "suggestions": []}
-    
-    match = re.search(r"```json(.*?)```", text, re.DOTALL)
-    
-    if match:
-        json_str = match.group(1).strip()
-        try:
-            data = json.loads(json_str)
-            result["chart"] = data.get("chart_code")
-            result["suggestions"] = data.get("related_questions", [])
-        except:
-            pass
-        text_part = text.replace(match.group(0), "").strip()
+        if turn["suggestions"]:
+            st.markdown("**💡 Next Actions:**")
+            cols = st.columns(len(turn["suggestions"]))
+            for idx, q in enumerate(turn["suggestions"]):
+                with cols[idx]:
+                    if st.button(q, key=f"sug_{i}_{idx}"):
+                        st.session_state.prompt_trigger = q
+                        st.rerun()
+
+def format_age(seconds):
+    """経過秒数を「3分前」などの表記にする"""
+    if seconds < 60: return "たった今"
+    if seconds < 3600: return f"{int(seconds // 60)}分前"
+    if seconds < 86400: return f"{int(seconds // 3600)}時間前"
+    return f"{int(seconds // 86400)}日前"
+
+def run_sync(scheduler):
+    """画面から1回同期する (進捗をその場に表示し、成功したら新しい版で再実行)"""
+    if not NOTION_KEY or not NOTION_PAGE_ID:
+        st.error("Notion APIキーまたはページIDが設定されていません")
+        return
+    with st.status("Fetching Data..."):
+        corpus = scheduler.run_once(progress=lambda msg: st.write(msg))
+    if corpus is None:
+        st.error(f"同期に失敗しました: {scheduler.last_error}")
     else:
-        text_part = text.strip()
-    
-    # 生コードフィルター
-    text_part = re.sub(r"```(?:dot|graphviz)?\s*digraph.*?```", "", text_part, flags=re.DOTALL)
-    text_part = re.sub(r"```(?:mermaid)?\s*graph.*?```", "", text_part, flags=re.DOTALL)
-    text_part = re.sub(r"digraph\s+.*?}", "", text_part, flags=re.DOTALL | re.MULTILINE)
-
-    if not result["chart"]:
-        code_match = re.search(r"digraph.*?\}", text, re.DOTALL)
-        if code_match:
-            result["chart"] = code_match.group(0)
-
-    result["text"] = text_part.strip()
-    return result
+        st.rerun()
+
+def is_admin_request():
+    """URL の ?admin= が ADMIN_TOKEN と一致するか (未設定なら URL からは開けない)"""
+    token = st.query_params.get("admin", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))
+
+def render_admin_panel():
+    """計測値の一覧とエクスポート・同期状態 (管理者向け)"""
+    with st.expander("🔄 SYNC"):
+        scheduler = get_sync_scheduler()
+        st.json(scheduler.status(), expanded=True)
+        if scheduler.scheduled and st.button("今すぐ同期", key="sync_now"): scheduler.trigger()
+        if PREWARM: st.json({"prewarm": get_prewarmer().status()}, expanded=False)
+    with st.expander("📈 METRICS"):
+        summary = METRICS.summary()
+        rows = [{"stage": name, "count": t["count"],
+                 "p50_ms": round(t["p50"] * 1000, 1), "p95_ms": round(t["p95"] * 1000, 1)}
+                for name, t in summary["timers"].items() if t["p50"] is not None]
+        if rows: st.dataframe(rows, hide_index=True, use_container_width=True)
+        else: st.caption("No data")
+        if summary["counters"]: st.json(summary["counters"], expanded=False)
+        st.download_button("⬇ JSON Lines", METRICS.to_jsonl(), file_name="metrics.jsonl")
+        st.download_button("⬇ Prometheus", METRICS.to_prometheus(), file_name="metrics.prom")
 
 # --- 5. アプリ本体 ---
 def main():
     if "chat_history" not in st.session_state: st.session_state.chat_history = []
+    if "history_links" not in st.session_state: st.session_state.history_links = ""
+    if "history_window" not in st.session_state: st.session_state.history_window = HISTORY_WINDOW
     if "prompt_trigger" not in st.session_state: st.session_state.prompt_trigger = None
     if "memo" not in st.session_state: st.session_state.memo = ""
 
+    # マニュアルはプロセス共有。セッションには持たせず、再実行のたびに現行の版を読む
+    store = get_corpus_store()
+    scheduler = get_sync_scheduler()
+    corpus = store.current()
+
     col_left, col_center, col_right = st.columns([1, 3, 1], gap="medium")
 
     # ========= 左カラム (Shortcuts / History / Memo) =========
     with col_left:
         st.markdown("### 💠 SHORTCUTS")
-        presets = ["✈️ 海外旅行保険", "💴 経費精算フロー", "📞 緊急連絡網", "🥁 和太鼓手配", "🛂 ビザ申請"]
-        for p in presets:
+        for p in PRESETS:
             if st.button(p, key=p, use_container_width=True):
-                st.session_state.prompt_trigger = p.split(" ", 1)[1] if " " in p else p
+                st.session_state.prompt_trigger = preset_question(p)
                 st.rerun()
 
         st.divider()
         st.markdown("### 🕒 HISTORY")
         history_container = st.container(height=300, border=False)
         with history_container:
-            if st.session_state.chat_history:
-                for i, msg in enumerate(st.session_state.chat_history):
-                    if msg["role"] == "user":
-                        label = (msg["content"][:9] + "..") if len(msg["content"]) > 9 else msg["content"]
-                        st.markdown(f"<div class='history-link'><a href='#msg-{i}'>📄 {label}</a></div>", unsafe_allow_html=True)
+            # リンク一覧は質問追加時に追記済みのHTMLをまとめて1回で描画
+            if st.session_state.history_links:
+                st.markdown(st.session_state.history_links, unsafe_allow_html=True)
             else: st.caption("No History")
         
         st.divider()
@@ -313,16 +324,22 @@ def main():
         st.text_area("Sticky Note", value=st.session_state.memo, height=100, key="memo", placeholder="一時メモ...")
 
         st.divider()
-        if "manual_text" not in st.session_state:
-            if st.button("🔄 同期開始", type="primary", use_container_width=True):
-                if not NOTION_KEY or not NOTION_PAGE_ID:
-                    st.error("Notion APIキーまたはページIDが設定されていません")
-                else:
-                    loader = FullNotionLoader(NOTION_KEY)
-                    with st.status("Fetching Data..."):
-                        all_text, count = loader.load_recursive(NOTION_PAGE_ID, lambda msg: st.write(msg))
-                    st.session_state.manual_text = all_text
-                    st.rerun()
+        if corpus is None and scheduler.running:
+            render_sync_progress(scheduler)
+        elif corpus is None:
+            if st.button("🔄 同期開始", type="primary", use_container_width=True): run_sync(scheduler)
+        else:
+            # 同期済みでも Notion の更新を取り込めるよう、再同期 (差分のみ) はいつでも押せる
+            st.caption(f"📚 マニュアル {corpus.page_count}ページ (同期: {format_age(time.time() - corpus.synced_at)})")
+            if st.button("🔄 再同期", key="resync", use_container_width=True):
+                if scheduler.scheduled:
+                    scheduler.trigger()
+                    st.toast("裏で同期を開始しました")
+                elif scheduler.running: st.toast("裏で同期しています")
+                else: run_sync(scheduler)
+
+        if SHOW_ADMIN or is_admin_request():
+            render_admin_panel()
 
     # ========= 右カラム (Clock / Weather / News) =========
     with col_right:
@@ -387,27 +404,25 @@ def main():
         </div>
         """, unsafe_allow_html=True)
         
-        if "manual_text" not in st.session_state:
+        if corpus is None and scheduler.running:
+            st.info("マニュアルを同期しています。完了すると自動で表示されます")
+        elif corpus is None:
             st.info("👈 左メニューの「同期開始」ボタンを押してください")
         else:
             chat_container = st.container(height=600, border=False)
             
             with chat_container:
-                for i, msg in enumerate(st.session_state.chat_history):
-                    st.markdown(f"<div id='msg-{i}'></div>", unsafe_allow_html=True)
-                    with st.chat_message(msg["role"]):
-                        if msg["type"] == "text": st.markdown(msg["content"])
-                        elif msg["type"] == "chart": 
-                            try: st.graphviz_chart(msg["content"])
-                            except: pass
-                        elif msg["type"] == "suggestions":
-                            st.markdown("**💡 Next Actions:**")
-                            cols = st.columns(len(msg["content"]))
-                            for idx, q in enumerate(msg["content"]):
-                                with cols[idx]:
-                                    if st.button(q, key=f"sug_{i}_{idx}"):
-                                        st.session_state.prompt_trigger = q
-                                        st.rerun()
+                # 直近 history_window 件だけ描画し、それ以前は「以前の会話」で段階的に表示
+                turns = st.session_state.chat_history
+                start = max(0, len(turns) - st.session_state.history_window)
+                if start > 0:
+                    # 表示していない往復も HISTORY のリンク先だけは置いておく (「以前の会話」ボタンの位置へ飛ぶ)
+                    st.markdown("".join(f"<div id='msg-{i}'></div>" for i in range(start)), unsafe_allow_html=True)
+                    if st.button(f"⬆ 以前の会話を表示 (残り{start}件)", key="load_earlier", use_container_width=True):
+                        st.session_state.history_window += HISTORY_WINDOW
+                        st.rerun()
+                for i in range(start, len(turns)):
+                    render_turn(i, turns[i])
 
             trigger_input = st.session_state.prompt_trigger
             
@@ -421,80 +436,59 @@ def main():
                 with chat_container:
                     with st.chat_message("user"):
                         st.markdown(user_input)
-                st.session_state.chat_history.append({"role": "user", "type": "text", "content": user_input})
+                turn = add_turn(user_input)
 
                 if not GOOGLE_KEY:
                      st.error("Google APIキーが設定されていません")
                 else:
-                    genai.configure(api_key=GOOGLE_KEY)
-                    model = genai.GenerativeModel('gemini-2.0-flash')
-                    
-                    full_prompt = f"""
-                    【最重要設定】
-                    あなたはRSJP（立命館大学 留学サポートデスク）の**頼れる優しい先輩社員**です。
-                    単なる検索システムではなく、不安な後輩（ユーザー）を支えるパートナーとして振る舞ってください。
-
-                    【回答のルール】
-                    1. **説明のボリューム**:
-                       - 決して簡潔に済ませず、**詳しく、丁寧に**説明してください。
-                       - 「なぜそうするのか」という背景や理由も付け加えて、納得感を高めてください。
-                    
-                    2. **必須の構成**:
-                       - **導入と共感**: 「焦らず一緒に確認しましょう」など安心させる言葉から始める。
-                       - **具体的な手順**: 番号付きリストで詳細に。
-                       - **先輩からのアドバイス**: 間違いやすいポイントやコツを親身に教える。
-                       - **締め**: 「応援しています」などの温かい言葉。
-
-                    3. **フローチャート（最重要）**:
-                       - **必ず縦長 (`rankdir=TB`) で作成してください。**
-                       - 省略せずに、**ステップを細かく分解してノード数を増やしてください。**
-                       - DOT言語 (digraph) を使用し、Mermaidは禁止です。
-
-                    【技術的な出力ルール】
-                    1. まず、上記の構成で**通常の文章（マークダウン）**を出力してください。
-                    2. その後に、以下のJSONブロックを1つだけ出力してください。
-                    
-                    ```json
-                    {{
-                        "chart_code": "digraph G {{ rankdir=TB; ... }}", 
-                        "related_questions": ["申請期限はいつ？", "必要書類は？", "代理申請は可能？"]
-                    }}
-                    ```
-                    
-                    **※重要1: `related_questions` には "Q1" 等ではなく、文脈に沿った具体的な次の質問文（例: "期限は？"）を入れてください。**
-                    **※重要2: `digraph ...` というコードは、絶対に「文章」の中には書かないでください。JSONの中だけに書いてください。**
-
-                    【質問】{user_input}
-                    【マニュアル】{st.session_state.manual_text}
-                    """
-
                     try:
-                        with st.spinner("先輩が考え中..."):
-                            response = model.generate_content(full_prompt)
-                            data = parse_hybrid_response(response.text)
-                            
-                            txt = data["text"]
-                            chart = data["chart"]
-                            sug = data["suggestions"]
-                        
                         with chat_container:
                             with st.chat_message("assistant"):
-                                st.markdown(txt)
+                                placeholder = st.empty()
+
+                                timing = {}
+
+                                def generate():
+                                    engine = get_answer_engine()
+                                    if STREAM_ANSWERS:
+                                        # 文章は届いた順に表示し、JSONブロックや生のDOTは表示前に取り除く
+                                        placeholder.caption("先輩が考え中...")
+                                        data, stats = engine.answer(corpus, user_input, on_text=lambda prose: placeholder.markdown(prose + "▌"))
+                                    else:
+                                        with st.spinner("先輩が考え中..."):
+                                            data, stats = engine.answer(corpus, user_input, stream=False)
+                                    timing.update(stats)
+                                    return data
+
+                                # 同じ質問 × 同じマニュアル版ならキャッシュから即表示
+                                key = cache_key(user_input, corpus)
+                                question_started = time.perf_counter()
+                                data, cached = get_answer_cache().get_or_compute(key, generate)
+                                METRICS.incr("answer.cache_hits" if cached else "answer.cache_misses")
+                                for name in ("prompt_chars", "response_chars", "prompt_tokens", "output_tokens", "cached_tokens"):
+                                    if timing.get(name): METRICS.incr(f"llm.{name}", timing[name])
+
+                                txt = data["text"]
+                                chart = data["chart"]
+                                sug = data["suggestions"]
+
+                                placeholder.markdown(txt)
                                 if chart and "digraph" in chart:
-                                    glass_style = 'graph [bgcolor="transparent", fontcolor="#0d47a1", ranksep=0.6]; node [color="#2196f3", fontcolor="#0d47a1", style="filled,rounded", fillcolor="#e3f2fd", fixedsize=false, width=0, height=0, margin="0.2,0.1"]; edge [color="#2196f3"];'
-                                    chart = chart.replace('digraph {', f'digraph {{ {glass_style}')
-                                    chart = chart.replace('digraph G {', f'digraph G {{ {glass_style}')
-                                    
+                                    chart = apply_glass_style(chart)
+
                                     st.markdown("---")
                                     st.caption("📊 Flowchart")
-                                    st.graphviz_chart(chart)
+                                    render_chart(chart)
 
-                        st.session_state.chat_history.append({"role": "assistant", "type": "text", "content": txt})
-                        if chart and "digraph" in chart:
-                            st.session_state.chat_history.append({"role": "assistant", "type": "chart", "content": chart})
+                        total = time.perf_counter() - question_started
+                        METRICS.observe("answer.total", total)
+                        METRICS.event("question", question_chars=len(user_input), cached=cached,
+                                      total_s=round(total, 4), **{k: round(v, 4) if isinstance(v, float) else v for k, v in timing.items()})
 
+                        turn["answer"] = txt
+                        if chart and "digraph" in chart: turn["chart"] = chart
                         if sug:
-                            st.session_state.chat_history.append({"role": "assistant", "type": "suggestions", "content": sug})
+                            turn["suggestions"] = sug
                             st.rerun()
                     
                     except Exception as e:
@@ -523,4 +517,5 @@ def main():
 
 if __name__ == "__main__":
 
-    main()
+    with METRICS.timer("app.rerun"):
+        main()
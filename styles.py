@@ -0,0 +1,121 @@
+import re
+
+# 画面全体のスタイル (編集はここで。送信時は _minify で詰める)
+_CSS = """
+<style>
+    @import url('https://fonts.googleapis.com/css2?family=Montserrat:wght@400;600;800&family=Noto+Sans+JP:wght@400;700&display=swap');
+    
+    .stApp {
+        background: #f4f6f9;
+        color: #1a237e;
+        font-family: 'Noto Sans JP', sans-serif;
+    }
+    header, #MainMenu, footer {visibility: hidden;}
+    .block-container { padding-top: 1rem; padding-bottom: 0rem; }
+
+    /* カラム共通 */
+    [data-testid="column"] {
+        background: rgba(255, 255, 255, 0.9);
+        border-radius: 12px;
+        padding: 15px;
+        box-shadow: 0 4px 15px rgba(0,0,0,0.03);
+        border: 1px solid white;
+        height: 100%;
+    }
+
+    /* --- ヘッダー --- */
+    .saas-header {
+        display: flex; justify-content: space-between; align-items: center;
+        background: linear-gradient(135deg, #7f1118, #b7102e); /* 立命館カラー */
+        padding: 20px 30px; border-radius: 16px; color: white;
+        box-shadow: 0 8px 32px rgba(127, 17, 24, 0.25); margin-bottom: 15px;
+    }
+    .saas-logo { font-family: 'Montserrat', sans-serif; font-size: 1.6em; font-weight: 800; letter-spacing: 1px; }
+    .saas-logo span { font-weight: 400; opacity: 0.8; margin-left: 8px; font-size: 0.8em; }
+    .status-indicator { background: rgba(255,255,255,0.1); padding: 5px 12px; border-radius: 20px; font-size: 0.75em; }
+
+    /* --- 右カラム: 情報パネル --- */
+    .info-card {
+        background: #263238; color: white;
+        border-radius: 10px; padding: 15px; margin-bottom: 15px;
+        font-family: 'Montserrat', sans-serif;
+        box-shadow: 0 4px 10px rgba(0,0,0,0.1);
+        border: 1px solid #37474f;
+    }
+    .card-label { color: #b0bec5; font-size: 0.7em; font-weight: 700; margin-bottom: 5px; text-transform: uppercase; }
+    .card-main { font-size: 1.8em; font-weight: 700; line-height: 1.0; }
+    .card-sub { font-size: 0.8em; color: #90a4ae; margin-top: 2px; }
+    
+    /* 天気行 */
+    .weather-row {
+        display: flex; justify-content: space-between; align-items: center;
+        margin-top: 10px; border-top: 1px solid #455a64; padding-top: 8px; font-size: 0.9em;
+    }
+
+    /* --- ニュースバナー & リスト --- */
+    .news-wrapper {
+        border-radius: 10px; overflow: hidden;
+        box-shadow: 0 4px 10px rgba(0,0,0,0.05);
+        margin-bottom: 20px; border: 1px solid #e0e0e0; background: white;
+    }
+    .news-banner {
+        /* 立命館スクールカラーに変更 */
+        background: linear-gradient(90deg, #7f1118, #b7102e);
+        color: white; padding: 10px 15px; font-family: 'Noto Sans JP', sans-serif;
+        font-weight: 700; font-size: 0.9em; display: flex; align-items: center;
+    }
+    .news-banner span { margin-left: auto; font-size: 0.7em; opacity: 0.8; background: rgba(255,255,255,0.2); padding: 2px 6px; border-radius: 4px; font-family: 'Montserrat', sans-serif;}
+    
+    .news-content { max-height: 500px; overflow-y: auto; padding: 0; }
+    .news-item {
+        display: block; padding: 10px 15px; border-bottom: 1px solid #f5f5f5;
+        text-decoration: none; color: #333; font-size: 0.85em; transition: 0.2s; line-height: 1.4;
+    }
+    .news-item:hover { background: #fef1f2; color: #b7102e; padding-left: 18px; }
+    .news-date { color: #999; font-size: 0.85em; margin-right: 8px; font-family: monospace; }
+
+    /* --- チャットエリア --- */
+    div[data-testid="stChatMessage"]:nth-of-type(odd) { flex-direction: row-reverse; text-align: right; }
+    div[data-testid="stChatMessage"]:nth-of-type(odd) div[data-testid="stMarkdownContainer"] {
+        background: linear-gradient(135deg, #e3f2fd, #bbdefb); color: #0d47a1;
+        padding: 12px 20px; border-radius: 18px 18px 0 18px; text-align: left;
+    }
+    div[data-testid="stChatMessage"]:nth-of-type(even) div[data-testid="stMarkdownContainer"] {
+        background: white; border: 1px solid #e0e0e0;
+        padding: 15px 25px; border-radius: 18px 18px 18px 0; width: 100%;
+    }
+    .stChatMessage .stAvatar { display: none; }
+
+    /* 入力欄 */
+    .stChatInput { position: fixed; bottom: 30px; left: 50%; transform: translateX(-50%); width: 50%; z-index: 1000; }
+    .stChatInput textarea {
+        border-radius: 28px !important; border: 1px solid #ddd !important;
+        padding: 15px 25px !important; min-height: 60px !important;
+        box-shadow: 0 10px 40px rgba(0,0,0,0.1) !important;
+    }
+    .stChatInput textarea:focus { border-color: #b7102e !important; }
+
+    /* 履歴リンク */
+    .history-link a {
+        display: block; padding: 8px 12px; margin-bottom: 6px; color: #555;
+        text-decoration: none; background: #f5f5f5; border-radius: 8px; font-size: 0.85em;
+        border-left: 3px solid transparent; transition: 0.2s;
+    }
+    .history-link a:hover { background: white; color: #b7102e; border-left: 3px solid #b7102e; }
+
+    /* フローチャート (サーバー側SVG) */
+    .flowchart { text-align: center; overflow-x: auto; }
+    .flowchart svg { max-width: 100%; height: auto; }
+
+</style>
+"""
+
+
+def _minify(css):
+    """コメントと余分な空白を除く (再実行のたびにブラウザへ送る量を減らす)"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{};,>])\s*", r"\1", css).strip()
+
+
+APP_CSS = _minify(_CSS)
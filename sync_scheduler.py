@@ -0,0 +1,133 @@
+import time
+import random
+import threading
+from metrics import METRICS
+
+
+class SyncScheduler:
+    """マニュアルの定期同期 (デーモンスレッドで裏で作り直し、完全に取れたときだけ差し替える)
+
+    build(progress) -> (text, page_count) は不完全な取得なら例外を投げること。
+    公開は CorpusStore.refresh 経由なので、読み手は常に古い版か新しい版の完全なものだけを見る。
+    on_publish(corpus) は同期で新しい版が公開されたときに呼ぶ (先回り生成など。すぐ戻ること)。
+    on_resync(corpus) は版が変わらなかった同期のあとに呼ぶ (失敗した後処理のやり直しなど)。
+    """
+    def __init__(self, store, build, interval=3600, jitter=0.1, on_publish=None, on_resync=None):
+        self.store = store
+        self.build = build
+        self.on_publish = on_publish
+        self.on_resync = on_resync
+        self.interval = interval
+        self.jitter = jitter
+        self.state = "idle"
+        self.progress = ""
+        self.runs = 0
+        self.failures = 0
+        self.last_started = None
+        self.last_finished = None
+        self.last_duration = None
+        self.last_success = None
+        self.last_error = None
+        self.next_run = None
+        self._stop = False
+        self._wake = threading.Event()
+        self._thread = None
+        # run_in_background の1回限りのスレッド
+        self._oneshot = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        """定期同期か1回限りの同期のスレッドが動いているか"""
+        return self.scheduled or (self._oneshot is not None and self._oneshot.is_alive())
+
+    @property
+    def scheduled(self):
+        """定期同期のスレッドが動いているか (trigger が効くのはこちらだけ)"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, initial_delay=0):
+        """同期スレッドを開始 (起動済みなら何もしない)"""
+        with self._lock:
+            if self.scheduled: return
+            self._stop = False
+            self.next_run = time.time() + initial_delay
+            self._thread = threading.Thread(target=self._loop, name="manual-sync", daemon=True)
+            self._thread.start()
+
+    def run_in_background(self):
+        """1回だけ裏で同期する (定期同期のスレッドが動いていれば何もしない)"""
+        with self._lock:
+            if self.running: return
+            self._oneshot = threading.Thread(target=self.run_once, name="manual-sync-once", daemon=True)
+            self._oneshot.start()
+
+    def stop(self):
+        self._stop = True
+        self._wake.set()
+
+    def trigger(self):
+        """次の同期を今すぐ行う (スレッドが動いていなければ何もしない)"""
+        self.next_run = time.time()
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop:
+            delay = self.next_run - time.time()
+            if delay > 0:
+                self._wake.wait(delay)
+                self._wake.clear()
+                continue
+            self.run_once()
+            # 複数インスタンスが同時に Notion を叩かないよう間隔を揺らす
+            self.next_run = time.time() + self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def run_once(self, progress=None):
+        """1回同期する。失敗・不完全なら現行の版をそのまま残して None を返す"""
+        started = time.time()
+        self.state, self.last_started, self.progress = "running", started, ""
+
+        def report(msg):
+            self.progress = msg
+            if progress: progress(msg)
+
+        previous = self.store.current()
+        try:
+            corpus = self.store.refresh(lambda: self.build(report))
+        except Exception as e:
+            corpus = None
+            self.failures += 1
+            self.state, self.last_error = "error", f"{type(e).__name__}: {e}"
+            METRICS.incr("sync.failures")
+        else:
+            self.state, self.last_error, self.last_success = "ok", None, time.time()
+            changed = corpus is not None and (previous is None or previous.version != corpus.version)
+            name = "on_publish" if changed else "on_resync"
+            hook = getattr(self, name)
+            if hook and corpus is not None:
+                # 後処理の失敗で同期スレッドを止めない (同期自体は成功として扱う)
+                try:
+                    hook(corpus)
+                except Exception as e:
+                    self.last_error = f"{name}: {type(e).__name__}: {e}"
+                    METRICS.incr("sync.publish_hook_failures")
+        self.runs += 1
+        self.last_finished = time.time()
+        self.last_duration = self.last_finished - started
+        return corpus
+
+    def status(self):
+        """管理画面向けの状態 (現在の版とその経過時間、直近の同期結果)"""
+        now = time.time()
+        corpus = self.store.current()
+        return {
+            "state": self.state, "scheduled": self.scheduled, "interval_s": self.interval,
+            "progress": self.progress if self.state == "running" else "",
+            "version": corpus.version if corpus else None,
+            "pages": corpus.page_count if corpus else 0,
+            "version_age_s": round(now - corpus.synced_at, 1) if corpus else None,
+            "last_duration_s": round(self.last_duration, 2) if self.last_duration is not None else None,
+            "last_success_ago_s": round(now - self.last_success, 1) if self.last_success else None,
+            "next_run_in_s": round(max(0.0, self.next_run - now), 1) if self.scheduled and self.next_run else None,
+            "runs": self.runs, "failures": self.failures, "last_error": self.last_error,
+        }